@@ -8,7 +8,7 @@ from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Request
 from app.core.config import settings
 from app.helpers.exception_handler import CustomException
 from app.helpers.login_manager import login_required, PermissionRequired
-from app.mq_main import redis
+from app.helpers.queue.task_state import TaskStateStore
 from app.schemas.base import DataResponse
 
 from app.schemas.chatdoc import EmbedDocRequest, ChatDocLCRequest, ChatDocRAGRequest
@@ -38,10 +38,14 @@ def embed_doc_queue(
         files: pdf|doc|docx|txt|xls|xlsx|csv|ppt|pptx|md|html|xml
         urls (list): [file, web].
             - file: pdf|doc|docx|txt|xls|xlsx|csv|ppt|pptx|md|html|xml
+        data_id (str): ('rag') Append to this collection instead of creating a new one.
+            Files already in it are skipped.
+        remove_sources (list): ('rag') source_id to remove from [data_id].
 
     Returns:
 
         data_id (str): The collection name to chat
+        sources (list): ('rag') [{source_id, source, status: added|unchanged}]
 
     Note:
     """
@@ -55,6 +59,7 @@ def embed_doc_queue(
             "application/vnd.openxmlformats-officedocument.presentationml.presentation",
             "text/markdown", "text/html", "application/xml", "text/xml"
         ]
+        files = files or []
         for file in files:
             if file.content_type not in types:
                 message = f"Invalid file format. Only {types} type files are supported (current format is '{file.content_type}')"
@@ -70,7 +75,7 @@ def embed_doc_queue(
             files_path.append(CommonService().save_url_file(url, save_directory=os.path.join(settings.WORKER_DIRECTORY, 'files')))
 
         # Handler both when empty
-        if not files_path and not web_urls:
+        if not files_path and not web_urls and not request.remove_sources:
             message = "Don't find your [files, urls]. Please check your input."
             raise ValueError(message)
 
@@ -79,10 +84,12 @@ def embed_doc_queue(
             'chat_type': request.chat_type,
             'files_path': files_path,
             'web_urls': web_urls,
+            'data_id': request.data_id,
+            'remove_sources': request.remove_sources,
         })
 
         utc_now, task_id, data = CommonService().init_task_queue()
-        redis.set(task_id, json.dumps(data.__dict__))
+        TaskStateStore.create(task_id, data.__dict__)
         bg_task.add_task(ChatDocService().embed_doc_queue, task_id, data, request_queue)
         return DataResponse().success_response(data=QueueResponse(status="PENDING", time=utc_now, task_id=task_id))
 
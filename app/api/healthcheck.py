@@ -9,8 +9,11 @@ from app.schemas.base import ResponseSchemaBase
 from app.schemas.base import DataResponse
 from app.services.common import CommonService
 from app.core.config import settings
+from app.core.security import PasswordHasher
+from app.db.pool_metrics import PoolMetrics
 
-from app.mq_main import celery_execute, redis
+from app.helpers.queue.task_state import TaskStateStore, AsyncTaskStateStore
+from app.mq_main import celery_execute
 
 
 router = APIRouter()
@@ -21,15 +24,33 @@ async def healthcheck():
     return {"message": "Health check success"}
 
 
+@router.get("/db", response_model=DataResponse[dict])
+async def healthcheck_db() -> Any:
+    """
+    Connection pool of the app process: size, checked_out, checked_in, overflow, checkouts,
+    and waits for a connection (timeouts, wait_avg/wait_max in seconds)
+    """
+    return DataResponse().success_response(data=PoolMetrics.snapshot())
+
+
+@router.get("/auth", response_model=DataResponse[dict])
+async def healthcheck_auth() -> Any:
+    """
+    Password hashing pool of the app process: pending calls, logins_per_minute, verified/failed/rehashed/hashed,
+    rejected (overloaded) and latency_avg/latency_max in seconds
+    """
+    return DataResponse().success_response(data=PasswordHasher.metrics())
+
+
 @router.post(
     "/queue",
     response_model=DataResponse[QueueResponse]
 )
-def healthcheck_queue(bg_task: BackgroundTasks) -> Any:
+async def healthcheck_queue(bg_task: BackgroundTasks) -> Any:
     """
     """
     utc_now, task_id, data = CommonService().init_task_queue()
-    redis.set(task_id, json.dumps(data.__dict__))
+    await AsyncTaskStateStore.create(task_id, data.__dict__)
     bg_task.add_task(HealthCheckServices.healthcheck_queue, task_id, data)
     return DataResponse().success_response(data=QueueResponse(status="PENDING", time=utc_now, task_id=task_id))
 
@@ -51,16 +72,13 @@ class HealthCheckServices(object):
                     'task_id': task_id,
                     'data': data_dump,
                 },
-                queue=settings.WORKER_NAME
+                queue=settings.WORKER_NAME,
+                task_id=task_id,
             )
         except ValueError as e:
             logging.getLogger('app').debug(e, exc_info=True)
-            data.status['general_status'] = "FAILED"
-            data.error = {'code': "400", 'message': str(e)}
-            redis.set(task_id, json.dumps(data.__dict__))
+            TaskStateStore.rejected(task_id, {'code': "400", 'message': str(e)})
 
         except Exception as e:
             logging.getLogger('app').debug(e, exc_info=True)
-            data.status['general_status'] = "FAILED"
-            data.error = {'code': "500", 'message': "Internal Server Error"}
-            redis.set(task_id, json.dumps(data.__dict__))
+            TaskStateStore.rejected(task_id, {'code': "500", 'message': "Internal Server Error"})
@@ -1,13 +1,16 @@
 from datetime import datetime
 
-from fastapi import APIRouter, HTTPException
-from fastapi_sqlalchemy import db
+from fastapi import APIRouter, HTTPException, Depends
+from app.db.session import db
 from pydantic import EmailStr, BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import settings
 from app.core.security import create_access_token
+from app.db.base import get_async_db
 from app.schemas.base import DataResponse
 from app.schemas.token import Token
-from app.services.user import UserService
+from app.services.user import UserService, AsyncUserService
 
 router = APIRouter()
 
@@ -17,17 +20,33 @@ class LoginRequest(BaseModel):
     password: str = 'my_pw'
 
 
-@router.post('', response_model=DataResponse[Token])
-def login_access_token(form_data: LoginRequest):
-    user = UserService().authenticate(username=form_data.username, password=form_data.password)
-    if not user:
-        raise HTTPException(status_code=400, detail='Incorrect email or password')
-    elif not user.is_active:
-        raise HTTPException(status_code=401, detail='Inactive user')
-
-    user.last_login = datetime.now()
-    db.session.commit()
-
-    return DataResponse().success_response({
-        'access_token': create_access_token(user_id=user.id)
-    })
+if settings.DB_ASYNC:
+    @router.post('', response_model=DataResponse[Token])
+    async def login_access_token(form_data: LoginRequest, session: AsyncSession = Depends(get_async_db)):
+        user = await AsyncUserService.authenticate(session, username=form_data.username, password=form_data.password)
+        if not user:
+            raise HTTPException(status_code=400, detail='Incorrect email or password')
+        elif not user.is_active:
+            raise HTTPException(status_code=401, detail='Inactive user')
+
+        user.last_login = datetime.now()
+        await session.commit()
+
+        return DataResponse().success_response({
+            'access_token': create_access_token(user_id=user.id)
+        })
+else:
+    @router.post('', response_model=DataResponse[Token])
+    def login_access_token(form_data: LoginRequest):
+        user = UserService().authenticate(username=form_data.username, password=form_data.password)
+        if not user:
+            raise HTTPException(status_code=400, detail='Incorrect email or password')
+        elif not user.is_active:
+            raise HTTPException(status_code=401, detail='Inactive user')
+
+        user.last_login = datetime.now()
+        db.session.commit()
+
+        return DataResponse().success_response({
+            'access_token': create_access_token(user_id=user.id)
+        })
@@ -1,16 +1,19 @@
 import json
 import logging
 from datetime import datetime
-import requests
-from requests.auth import HTTPBasicAuth
+from typing import List
 from fastapi import APIRouter, Depends, status
+from sse_starlette import EventSourceResponse
 
 from app.core.config import settings
 from app.helpers.exception_handler import CustomException
 from app.helpers.login_manager import login_required, PermissionRequired
 from app.schemas.base import DataResponse
-from app.schemas.queue import QueueResult
-from app.mq_main import redis
+from app.schemas.queue import QueueResult, QueueStatusBatchRequest
+from app.helpers.queue.task_state import AsyncTaskStateStore, task_key, task_channel, to_message, is_finished
+from app.helpers.queue.cancellation import AsyncTaskCancellation
+from app.helpers.queue.queue_depth import QueueDepthSampler
+from app.mq_main import redis_async, redis_async_pubsub
 
 logger = logging.getLogger()
 router = APIRouter()
@@ -21,7 +24,7 @@ router = APIRouter()
     dependencies=[Depends(login_required)],
     response_model=DataResponse[QueueResult]
 )
-def queue_status(
+async def queue_status(
         *,
         task_id: str,
 ):
@@ -38,59 +41,57 @@ def queue_status(
     - TIMELIMIT:
     - KILLED:
 
+    - TIMEOUT/TIMELIMIT are set by the background deadline sweeper (QUEUE_SWEEP_INTERVAL)
+
+    ### Queue:
+    - Snapshot sampled in background: {"queues": [...], "sampled_at", "staleness" (seconds)}
+
     """
-    data = redis.get(task_id)
-    if data is None:
+    message = await AsyncTaskStateStore.get(task_id)
+    if message is None:
         return DataResponse().success_response(
             data=QueueResult(task_id='', error={'code': "404", 'message': "task_id not found!"}))
 
-    message = json.loads(data)
-    message["queue"] = get_list_tasks_queue_rabbitmq()
-
-    # Handler if you don't have status_general, start_time
-    if not message["status"]["general_status"] or not message["status"]["general_status"].strip():
-        message["status"]["general_status"] = "PENDING"
-        data_dump = json.dumps(message)
-        redis.set(task_id, data_dump)
-
-    if not message["time"]["start_generate"] or not message["time"]["start_generate"].strip():
-        message["time"]["start_generate"] = str(datetime.utcnow().timestamp())
-        data_dump = json.dumps(message)
-        redis.set(task_id, data_dump)
-
-    # Check >QUEUE_TIMEOUT is still pending -> failed (don't come into worker)
-    status_general = message["status"]["general_status"]
-    start_time = float(message["time"]["start_generate"])
-    curr_time = datetime.utcnow().timestamp()
-    # print(start_time, curr_time)
-    # print(type(start_time), type(curr_time))
-    if curr_time - start_time > float(settings.QUEUE_TIMEOUT) and status_general == "PENDING":
-        logging.getLogger('app').debug(Exception(f"{task_id}: Worker is don't working, or queue time out!"), exc_info=True)
-        message["status"]["general_status"] = "TIMEOUT"
-        message["time"]["end_generate"] = str(curr_time)
-        message['error'] = {'code': "500", 'message': "Internal Server Error!"}
-        data_dump = json.dumps(message)
-        redis.set(task_id, data_dump)
-
-    # Check task is working -> dead -> failed ()
-    status_task = message["status"]["task_status"]
-    if (status_general == "SUCCESS" and status_task != "SUCCESS") and curr_time - start_time > float(settings.QUEUE_TIME_LIMIT) * 2:
-        logging.getLogger('app').debug(Exception(f"{task_id}: Task failed after work, maybe worker dead when processing"), exc_info=True)
-        message["status"]["general_status"] = "TIMELIMIT"
-        message["time"]["end_generate"] = str(curr_time)
-        message['error'] = {'code': "500", 'message': "Internal Server Error!"}
-        data_dump = json.dumps(message)
-        redis.set(task_id, data_dump)
+    message["queue"] = QueueDepthSampler.snapshot()
 
     return DataResponse().success_response(data=message)
 
 
+@router.post(
+    "/status:batch",
+    dependencies=[Depends(login_required)],
+    response_model=DataResponse[List[QueueResult]]
+)
+async def queue_status_batch(
+        *,
+        request: QueueStatusBatchRequest,
+):
+    """## Check status of many tasks at once
+
+    ### Args:
+    - task_ids (list): task ids (max 100)
+
+    ### Returns:
+    - Same order as `task_ids`, see `GET /status/{task_id}`. Unknown ids come back with error 404.
+
+    """
+    messages = await AsyncTaskStateStore.get_many(request.task_ids)
+    snapshot = QueueDepthSampler.snapshot()
+
+    results = [
+        dict(message, queue=snapshot) if message is not None
+        else QueueResult(task_id=task_id, error={'code': "404", 'message': "task_id not found!"})
+        for task_id, message in zip(request.task_ids, messages)
+    ]
+    return DataResponse().success_response(data=results)
+
+
 @router.put(
     "/status/{task_id}",
     dependencies=[Depends(login_required)],
     response_model=DataResponse[QueueResult]
 )
-def delete_task(
+async def delete_task(
         *,
         task_id: str,
 ):
@@ -100,55 +101,88 @@ def delete_task(
         "general_status": "PENDING"
         "task_status": None
 
+        "general_status": "SUCCESS"
+        "task_status": "STARTED" (the worker stops at its next check point)
+
     """
-    data = redis.get(task_id)
-    if data is None:
+    message = await AsyncTaskStateStore.get(task_id)
+    if message is None:
         return DataResponse().success_response(
             data=QueueResult(task_id='', error={'code': "404", 'message': "task_id not found!"}))
 
-    message = json.loads(data)
-    general_status = message["status"]["general_status"]
-
-    if general_status == "PENDING":
+    if await AsyncTaskStateStore.killed(task_id):
         message["status"]["general_status"] = "KILLED"
         message["time"]["end_generate"] = str(datetime.utcnow().timestamp())
         message['error'] = {'code': "200", 'message': "Task Killed!"}
-        data_dump = json.dumps(message)
-        redis.set(task_id, data_dump)
-
-        # init redis task
-        json_tasks_removed = redis.get("tasks_removed")
-        if not json_tasks_removed:
-            tasks_removed = []
-            redis.set("tasks_removed", json.dumps(tasks_removed))
-        else:
-            tasks_removed = json.loads(json_tasks_removed)
 
-        # Add to list task removed into 'tasks_removed' in redis
-        tasks_removed.append(task_id)
-        redis.set("tasks_removed", json.dumps(tasks_removed))
+        await AsyncTaskCancellation.cancel(task_id)
 
     else:
         return DataResponse().success_response(
-            data=QueueResult(task_id=task_id, error={'code': "400", 'message': "Task must is 'PENDING'"}))
+            data=QueueResult(task_id=task_id, error={'code': "400", 'message': "Task must is 'PENDING' or 'STARTED'"}))
 
     return DataResponse().success_response(data=message)
 
 
-def get_list_tasks_queue_rabbitmq():
-    username = settings.RABBITMQ_USER
-    password = settings.RABBITMQ_PASS
-    server = f'http://{settings.RABBITMQ_HOST}:15672'
+@router.get(
+    "/stream/{task_id}",
+    dependencies=[Depends(login_required)],
+)
+async def queue_stream(
+        *,
+        task_id: str,
+):
+    """## Stream status of task (Server-Sent Events)
 
-    response = requests.get(f'{server}/api/queues', auth=HTTPBasicAuth(username, password))
+    ### Args:
+    - task_id (str): task id
 
-    if response.status_code == 200:
-        queues = response.json()
-        final_queues = []
-        for queue in queues:
-            if "." not in queue['name'] and "@" not in queue['name']:
-                final_queues.append({"name": queue['name'], "num_task_queueing": queue.get('messages', 0)})
-    else:
-        raise Exception("Can't connect to RabbitMQ")
+    ### Returns:
+    - [STATUS] <json QueueResult> -> ... -> [STATUS] <json QueueResult> -> [DONE]
+    - Pushed on every status transition, stream closes when the task is finished.
 
-    return final_queues
\ No newline at end of file
+    """
+    return EventSourceResponse(stream_task_status(task_id))
+
+
+def stream_data(stream_type: str, task_id: str, data):
+    return {
+        "event": stream_type,
+        "id": task_id,
+        "retry": settings.RETRY_TIMEOUT,
+        "data": data,
+    }
+
+
+async def stream_task_status(task_id: str):
+    pubsub = redis_async_pubsub.pubsub()
+    # Subscribe before reading the current state, so no transition is missed in between
+    await pubsub.subscribe(task_channel(task_id))
+    try:
+        message = to_message(await redis_async.hgetall(task_key(task_id)))
+        if message is None:
+            message = QueueResult(task_id='', error={'code': "404", 'message': "task_id not found!"}).dict()
+            yield stream_data("STATUS", task_id, json.dumps(message))
+            yield stream_data("DONE", task_id, "DONE")
+            return
+
+        yield stream_data("STATUS", task_id, json.dumps(message))
+
+        # Safety net: the sweeper publishes TIMEOUT/TIMELIMIT before this
+        deadline = float(message["time"]["start_generate"] or datetime.utcnow().timestamp()) \
+            + float(settings.QUEUE_TIMEOUT) + float(settings.QUEUE_TIME_LIMIT) * 2 + settings.QUEUE_SWEEP_INTERVAL * 2
+        while not is_finished(message):
+            event = await pubsub.get_message(ignore_subscribe_messages=True, timeout=settings.QUEUE_STREAM_KEEPALIVE)
+            if event is None:
+                if datetime.utcnow().timestamp() > deadline:
+                    break
+                continue
+
+            message = to_message(json.loads(event["data"]))
+            yield stream_data("STATUS", task_id, json.dumps(message))
+
+        yield stream_data("DONE", task_id, "DONE")
+
+    finally:
+        await pubsub.unsubscribe(task_channel(task_id))
+        await pubsub.close()
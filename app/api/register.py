@@ -1,7 +1,7 @@
 from typing import Any
 
 from fastapi import APIRouter, Depends
-from fastapi_sqlalchemy import db
+from app.db.session import db
 
 from app.helpers.exception_handler import CustomException
 from app.models import User
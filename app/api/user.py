@@ -2,11 +2,11 @@ import logging
 from typing import Any
 
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi_sqlalchemy import db
+from app.db.session import db
 
 from app.helpers.exception_handler import CustomException
 from app.helpers.login_manager import login_required, PermissionRequired
-from app.helpers.paging import Page, PaginationParams, paginate
+from app.helpers.paging import Page, PaginationParams, paginate, CursorPage, CursorParams, cursor_paginate
 from app.schemas.base import DataResponse
 from app.schemas.user import UserItemResponse, UserCreateRequest, UserUpdateMeRequest, UserUpdateRequest
 from app.services.user import UserService
@@ -15,6 +15,8 @@ from app.models import User
 logger = logging.getLogger()
 router = APIRouter()
 
+CURSOR_SORTABLE = ('id', 'created_at')  # Never NULL (created_at: ORM default), nothing private in cursors
+
 
 @router.get(
     "",
@@ -36,6 +38,23 @@ def get(params: PaginationParams = Depends()) -> Any:
         return HTTPException(status_code=400, detail=logger.error(e))
 
 
+@router.get(
+    "/cursor",
+    dependencies=[Depends(PermissionRequired('admin'))],
+    response_model=CursorPage[UserItemResponse])
+def get_cursor(params: CursorParams = Depends()) -> Any:
+    """
+    API Get list User, keyset pagination: follow metadata.next_cursor/prev_cursor,
+    total (exact/estimate/none) only when asked
+
+    requires:
+
+        - admin role
+    """
+    _query = db.session.query(User)
+    return cursor_paginate(model=User, query=_query, params=params, sortable=CURSOR_SORTABLE)
+
+
 @router.post(
     "",
     dependencies=[Depends(PermissionRequired('admin'))],
@@ -62,7 +81,7 @@ def create(user_data: UserCreateRequest) -> Any:
     "/me",
     dependencies=[Depends(login_required)],
     response_model=DataResponse[UserItemResponse])
-def detail_me(current_user: User = Depends(UserService().get_current_user)) -> Any:
+def detail_me(current_user: UserItemResponse = Depends(UserService().get_current_principal)) -> Any:
     """
     API get detail current User
 
@@ -11,6 +11,7 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = 'FASTAPI BASE'
     BASE_HOST: str = "0.0.0.0"
     BASE_PORT: int = 8000
+    BASE_LIMIT_CONCURRENCY: int = 1000  # Open connections (idle SSE streams included)
     SECRET_KEY: str
     API_PREFIX: str = ''
     BACKEND_CORS_ORIGINS: list[str] = ['*']
@@ -18,6 +19,17 @@ class Settings(BaseSettings):
         100 * 365 * 24 * 60 * 60
     )  # Token expired after 100 years => no expired
     SECURITY_ALGORITHM: str = 'HS256'
+    PASSWORD_SCHEMES: list[str] = ["bcrypt"]  # First one hashes, the others are verified then rehashed on login
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+    PASSWORD_ARGON2_TIME_COST: int = 3
+    PASSWORD_ARGON2_MEMORY_COST: int = 64 * 1024  # KiB
+    PASSWORD_ARGON2_PARALLELISM: int = 1
+    PASSWORD_HASH_PROCESSES: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 64  # Hash/verify calls queued on the pool, more are rejected (503)
+    AUTH_CACHE_SIZE: int = 10000  # Authenticated users kept in process
+    AUTH_CACHE_TTL: float = 30  # In process (bounds staleness across app processes)
+    AUTH_CACHE_REDIS: bool = True  # Shared tier between app processes
+    AUTH_CACHE_REDIS_TTL: int = 10 * 60
     LOGGING_CONFIG_FILE: str = "logging.ini"
     LOGGING_APP_FILE: str = "app.log"
     STATIC_URL: str = "static"
@@ -28,6 +40,11 @@ class Settings(BaseSettings):
 
     # Database
     DATABASE_URL: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 10  # Wait for a free connection
+    DB_POOL_RECYCLE: int = 30 * 60
+    DB_ASYNC: bool = False  # Auth/user routes on the asyncpg engine (same DATABASE_URL)
     SUPERUSER_NAME: str = "admin"
     SUPERUSER_PASSWORD: str = "admin"
 
@@ -37,6 +54,12 @@ class Settings(BaseSettings):
     REDIS_PORT: int = 6379
     REDIS_PASS: str = ""
     REDIS_DB: int = 0
+    REDIS_POOL_SIZE: int = 50  # App async pool (waits for a free connection when exhausted)
+    REDIS_POOL_TIMEOUT: float = 5
+    REDIS_PUBSUB_POOL_SIZE: int = 1000  # One connection per open status stream
+    REDIS_SOCKET_TIMEOUT: float = 5
+    REDIS_CONNECT_TIMEOUT: float = 5
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
     @property
     def REDIS_BACKEND(self) -> str:
         return f"redis://:{self.REDIS_PASS}@{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_DB}"
@@ -52,12 +75,45 @@ class Settings(BaseSettings):
 
     QUEUE_TIMEOUT: int = 60 * 60
     QUEUE_TIME_LIMIT: int = 5 * 60
+    QUEUE_RESULT_EXPIRES: int = 60 * 60 * 48
+    QUEUE_DEPTH_INTERVAL: int = 5
+    QUEUE_DEPTH_QUEUES: list[str] = []  # Default: [WORKER_NAME]
+    QUEUE_STREAM_KEEPALIVE: float = 15
+    QUEUE_SWEEP_INTERVAL: int = 10
+    QUEUE_SWEEP_BATCH: int = 500
     WORKER_DIRECTORY: str = "static/worker"
+    WORKER_LOADER_PROCESSES: int = 4  # Partition files in parallel (0: sequential)
+    WORKER_LOADER_THREADS: int = 8  # Fetch urls in parallel
+    WORKER_PIPELINE_QUEUE_SIZE: int = 2  # Batches buffered between ingestion stages
 
     # LLM
     LLM_URL: str
+    LLM_MAX_CONNECTIONS: int = 200  # Per (platform, base_url) client
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 50
+    LLM_KEEPALIVE_EXPIRY: float = 60
+    LLM_CONNECT_TIMEOUT: float = 10
+    LLM_TIMEOUT: float = 600  # Read timeout, between two chunks of a stream
+    LLM_HTTP2: bool = True  # Used when `h2` is installed
     EM_URL: str
+    EM_MODEL: str = "BAAI/bge-m3"  # Part of the embedding cache and ingestion dedup keys
+    EM_VECTOR_SIZE: int = 1024  # Output size of EM_MODEL, part of the ingestion dedup key
+    EM_CACHE_TTL: int = 30 * 24 * 60 * 60
+    EM_BATCH_SIZE: int = 64  # Initial size, adapted to the server
+    EM_MAX_BATCH_SIZE: int = 128  # TEI --max-client-batch-size
+    EM_BATCH_STEP: int = 8
+    EM_CONCURRENCY: int = 4
+    EM_TARGET_LATENCY: float = 2
+    EM_RETRIES: int = 5
+    EM_BACKOFF_BASE: float = 0.5
+    EM_BACKOFF_MAX: float = 10
+    EM_TIMEOUT: float = 60
     VDB_URL: str
+    RAG_TOP_K: int = 20  # Candidates of each search (dense, BM25)
+    RAG_CONTEXT_TOKENS: int = 3000
+    RAG_RERANK_URL: str = ""  # TEI reranker, rerank disabled when empty
+    LC_CONTEXT_WINDOW: int = 128000  # Model input window, the 'lc' document is trimmed to fit
+    LC_PROMPT_RESERVE: int = 512  # Prompt template around the document
+    LC_CACHE_SIZE: int = 32  # Documents kept mapped
 
     # OpenAI
     OPENAI_API_KEY: str
@@ -65,6 +121,14 @@ class Settings(BaseSettings):
     # Google Search
     GOOGLE_API_KEY: str
     GOOGLE_CSE_ID: str
+    SEARCH_INTENT_CACHE_TTL: int = 60 * 60  # LLM decisions per (date, user turns)
+    SEARCH_INTENT_CHECK_TIMEOUT: float = 10  # Chat without web search when the LLM check is slower
+    SCRAPE_CONCURRENCY: int = 8
+    SCRAPE_TIMEOUT: float = 5  # Per page
+    SCRAPE_DEADLINE: float = 8  # All pages of a search, slower ones are dropped
+    SCRAPE_MAX_BYTES: int = 2 * 1024 * 1024  # Body read per page, the rest is ignored
+    SCRAPE_FRESH: int = 5 * 60  # Cached text served without revalidation
+    SCRAPE_CACHE_TTL: int = 24 * 60 * 60  # Cached text revalidated with ETag/Last-Modified
 
     class Config:
         env_file = os.path.join(BASE_DIR, '.env')
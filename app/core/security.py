@@ -1,11 +1,33 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+
 import jwt
 
-from typing import Any, Union
+from typing import Any, Union, Optional, Tuple, Callable
 from app.core.config import settings
+from app.helpers.exception_handler import CustomException
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Rounds/costs pinned (min = max = default): a hash made with other parameters `needs_update`
+pwd_context = CryptContext(
+    schemes=settings.PASSWORD_SCHEMES,
+    deprecated="auto",
+    bcrypt__rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    argon2__rounds=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2__min_rounds=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2__max_rounds=settings.PASSWORD_ARGON2_TIME_COST,
+    argon2__memory_cost=settings.PASSWORD_ARGON2_MEMORY_COST,
+    argon2__parallelism=settings.PASSWORD_ARGON2_PARALLELISM,
+)
 
 
 def create_access_token(user_id: Union[int, Any]) -> str:
@@ -23,5 +45,140 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Return (valid, new hash when `hashed_password` was made with other scheme/parameters)."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+class PasswordHashOverloaded(CustomException):
+    """More than PASSWORD_HASH_MAX_PENDING hash/verify calls waiting."""
+
+    def __init__(self):
+        super().__init__(http_code=503, code='503', message="Too many login requests, please try again later")
+
+
+class PasswordHasher(object):
+    """
+    Password hashing/verification of the request paths, on a process pool (PASSWORD_HASH_PROCESSES):
+    a login burst uses those cores only, instead of holding request threads and the GIL.
+    Beyond PASSWORD_HASH_MAX_PENDING pending calls, new ones fail fast (`PasswordHashOverloaded`).
+    Scripts/tests keep the in-process `get_password_hash`/`verify_password`.
+    """
+    __instance = None
+    _pool: Optional[ProcessPoolExecutor] = None
+    _lock = threading.Lock()
+    _pending = 0
+    _logins = deque(maxlen=10000)  # Login (verify) completion times, for the rate
+    _stats = {"verified": 0, "failed": 0, "rehashed": 0, "hashed": 0, "rejected": 0, "seconds": 0.0, "max": 0.0}
+
+    @staticmethod
+    def pool() -> ProcessPoolExecutor:
+        with PasswordHasher._lock:
+            if PasswordHasher._pool is None:
+                # 'spawn': children must not inherit the app process (event loop, open connections)
+                PasswordHasher._pool = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_PROCESSES,
+                                                           mp_context=multiprocessing.get_context("spawn"))
+            return PasswordHasher._pool
+
+    @staticmethod
+    def shutdown() -> None:
+        with PasswordHasher._lock:
+            pool, PasswordHasher._pool = PasswordHasher._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def submit(fn: Callable, *args) -> Future:
+        with PasswordHasher._lock:
+            if PasswordHasher._pending >= settings.PASSWORD_HASH_MAX_PENDING:
+                PasswordHasher._stats["rejected"] += 1
+                raise PasswordHashOverloaded()
+            PasswordHasher._pending += 1
+        try:
+            try:
+                future = PasswordHasher.pool().submit(fn, *args)
+            except BrokenProcessPool:
+                PasswordHasher.shutdown()
+                future = PasswordHasher.pool().submit(fn, *args)
+        except BaseException:
+            PasswordHasher.done(None)
+            raise
+        future.add_done_callback(PasswordHasher.done)
+        return future
+
+    @staticmethod
+    def done(future: Optional[Future]) -> None:
+        with PasswordHasher._lock:
+            PasswordHasher._pending -= 1
+        if future is not None and not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            logging.getLogger('app').warning("Password hash pool broken, restart it.")
+            PasswordHasher.shutdown()
+
+    @staticmethod
+    def record(started: float, **counts) -> None:
+        elapsed = time.perf_counter() - started
+        with PasswordHasher._lock:
+            for name, count in counts.items():
+                PasswordHasher._stats[name] += count
+            PasswordHasher._stats["seconds"] += elapsed
+            PasswordHasher._stats["max"] = max(PasswordHasher._stats["max"], elapsed)
+            if "verified" in counts or "failed" in counts:
+                PasswordHasher._logins.append(time.monotonic())
+
+    @staticmethod
+    def record_verify(started: float, result: Tuple[bool, Optional[str]]) -> Tuple[bool, Optional[str]]:
+        valid, new_hash = result
+        PasswordHasher.record(started, **{"verified" if valid else "failed": 1, "rehashed": int(new_hash is not None)})
+        return result
+
+    @staticmethod
+    def verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        started = time.perf_counter()
+        result = PasswordHasher.submit(verify_and_update_password, password, hashed_password).result()
+        return PasswordHasher.record_verify(started, result)
+
+    @staticmethod
+    async def averify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        started = time.perf_counter()
+        result = await asyncio.wrap_future(PasswordHasher.submit(verify_and_update_password, password, hashed_password))
+        return PasswordHasher.record_verify(started, result)
+
+    @staticmethod
+    def hash(password: str) -> str:
+        started = time.perf_counter()
+        hashed = PasswordHasher.submit(get_password_hash, password).result()
+        PasswordHasher.record(started, hashed=1)
+        return hashed
+
+    @staticmethod
+    async def ahash(password: str) -> str:
+        started = time.perf_counter()
+        hashed = await asyncio.wrap_future(PasswordHasher.submit(get_password_hash, password))
+        PasswordHasher.record(started, hashed=1)
+        return hashed
+
+    @staticmethod
+    def metrics() -> dict:
+        now = time.monotonic()
+        with PasswordHasher._lock:
+            stats = dict(PasswordHasher._stats)
+            logins_1m = sum(1 for t in PasswordHasher._logins if now - t <= 60)
+            pending = PasswordHasher._pending
+        calls = stats["verified"] + stats["failed"] + stats["hashed"]
+        return {
+            "schemes": settings.PASSWORD_SCHEMES,
+            "processes": settings.PASSWORD_HASH_PROCESSES,
+            "pending": pending,
+            "logins_per_minute": logins_1m,
+            "verified": stats["verified"],
+            "failed": stats["failed"],
+            "rehashed": stats["rehashed"],
+            "hashed": stats["hashed"],
+            "rejected": stats["rejected"],
+            "latency_avg": stats["seconds"] / calls if calls else 0.0,
+            "latency_max": stats["max"],
+        }
@@ -1,10 +1,42 @@
-from typing import Generator
+import re
+from typing import Generator, AsyncGenerator
 from app.core.config import settings
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+from app.db.pool_metrics import PoolMetrics
+
+engine = create_engine(
+    settings.DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+PoolMetrics.watch(engine)
+
+
+def async_database_url(url: str) -> str:
+    return re.sub(r"^postgres(ql)?(\+\w+)?://", "postgresql+asyncpg://", url)
+
+
+# Opt-in (DB_ASYNC): asyncpg engine for the auth/user routes
+async_engine = None
+AsyncSessionLocal = None
+if settings.DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(
+        async_database_url(settings.DATABASE_URL),
+        pool_pre_ping=True,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+    )
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 
 def get_db() -> Generator:
@@ -13,3 +45,8 @@ def get_db() -> Generator:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator:
+    async with AsyncSessionLocal() as session:
+        yield session
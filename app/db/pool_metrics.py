@@ -0,0 +1,56 @@
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class PoolMetrics(object):
+    """Checkouts of the app engine pool, and how long requests waited for their connection."""
+    __instance = None
+    _lock = threading.Lock()
+    _engine = None
+    checkouts = 0
+    waits = 0
+    timeouts = 0
+    wait_total = 0.0
+    wait_max = 0.0
+
+    @staticmethod
+    def watch(engine: Engine) -> None:
+        PoolMetrics._engine = engine
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            with PoolMetrics._lock:
+                PoolMetrics.checkouts += 1
+
+    @staticmethod
+    def record_wait(started: float, timed_out: bool = False) -> None:
+        wait = time.perf_counter() - started
+        with PoolMetrics._lock:
+            PoolMetrics.waits += 1
+            PoolMetrics.wait_total += wait
+            PoolMetrics.wait_max = max(PoolMetrics.wait_max, wait)
+            if timed_out:
+                PoolMetrics.timeouts += 1
+
+    @staticmethod
+    def snapshot() -> dict:
+        pool = PoolMetrics._engine.pool if PoolMetrics._engine is not None else None
+        with PoolMetrics._lock:
+            waits = {
+                "checkouts": PoolMetrics.checkouts,
+                "timeouts": PoolMetrics.timeouts,
+                "wait_avg": PoolMetrics.wait_total / PoolMetrics.waits if PoolMetrics.waits else 0.0,
+                "wait_max": PoolMetrics.wait_max,
+            }
+        if pool is None or not hasattr(pool, "checkedout"):
+            return waits
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            **waits,
+        }
@@ -0,0 +1,123 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.types import ASGIApp, Receive, Scope, Send, Message
+
+from app.db.pool_metrics import PoolMetrics
+
+
+class MissingSessionError(Exception):
+    """`db.session` used outside of a request or a `with db():` block."""
+
+
+class LazySession(object):
+    """Session of one request, created (and its connection checked out) on first `db.session` access."""
+
+    def __init__(self, session_factory: sessionmaker):
+        self.session_factory = session_factory
+        self._session: Optional[Session] = None
+
+    @property
+    def session(self) -> Session:
+        if self._session is None:
+            session = self.session_factory()
+            started = time.perf_counter()
+            try:
+                session.connection()
+            except PoolTimeoutError:
+                PoolMetrics.record_wait(started, timed_out=True)
+                session.close()
+                raise
+            PoolMetrics.record_wait(started)
+            self._session = session
+        return self._session
+
+    def close(self) -> None:
+        session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+
+_current: ContextVar[Optional[LazySession]] = ContextVar("db_session", default=None)
+_session_factory: Optional[sessionmaker] = None  # Of the last middleware given a `db_url`, used by `with db():`
+
+
+class LazySessionMiddleware(object):
+    """
+    Request-scoped `db.session` (replaces fastapi_sqlalchemy's DBSessionMiddleware): nothing is checked out
+    until a route or dependency touches the database, and the session is closed (uncommitted work rolled back)
+    when the response starts, so SSE streams never hold a pooled connection.
+    An outer instance (e.g. tests with another `db_url`) wins over inner ones, and `with db():` uses the database
+    of the last instance given a `db_url`.
+    """
+
+    def __init__(self, app: ASGIApp, db_url: Optional[str] = None, engine_args: Optional[dict] = None):
+        global _session_factory
+        self.app = app
+        if db_url is not None:
+            self.session_factory = sessionmaker(
+                autocommit=False, autoflush=False, bind=create_engine(db_url, **(engine_args or {})))
+            _session_factory = self.session_factory
+        else:
+            from app.db.base import SessionLocal
+
+            self.session_factory = SessionLocal
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or _current.get() is not None:
+            await self.app(scope, receive, send)
+            return
+
+        lazy = LazySession(self.session_factory)
+        token = _current.set(lazy)
+
+        async def send_released(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                lazy.close()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_released)
+        finally:
+            lazy.close()
+            _current.reset(token)
+
+
+class _DB(object):
+    """`db.session` in requests; `with db():` elsewhere (scripts, tests)."""
+
+    @property
+    def session(self) -> Session:
+        lazy = _current.get()
+        if lazy is None:
+            raise MissingSessionError("No database session, use `with db():` outside of requests")
+        return lazy.session
+
+    def __call__(self, session_factory: Optional[sessionmaker] = None) -> "_DBContext":
+        return _DBContext(session_factory)
+
+
+class _DBContext(object):
+    def __init__(self, session_factory: Optional[sessionmaker] = None):
+        session_factory = session_factory or _session_factory
+        if session_factory is None:
+            from app.db.base import SessionLocal
+
+            session_factory = SessionLocal
+        self.lazy = LazySession(session_factory)
+        self.token = None
+
+    def __enter__(self) -> "_DBContext":
+        self.token = _current.set(self.lazy)
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.lazy.close()
+        _current.reset(self.token)
+
+
+db = _DB()
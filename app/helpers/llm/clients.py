@@ -0,0 +1,76 @@
+import importlib.util
+import logging
+from typing import Dict, Tuple, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.core.config import settings
+
+
+def http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+class LLMClientRegistry(object):
+    """
+    Long-lived `AsyncOpenAI` clients keyed by (platform, base_url), sharing one keep-alive connection pool each,
+    so a chat doesn't pay TCP/TLS setup before its first token. Created at startup, closed at shutdown.
+    """
+    __instance = None
+    _clients: Dict[Tuple[str, Optional[str]], AsyncOpenAI] = {}
+
+    @staticmethod
+    def base_url(platform: str) -> Optional[str]:
+        if platform == "OpenAI":
+            return None  # SDK default
+        elif platform == "local":
+            return settings.LLM_URL
+        raise ValueError(f"""Don't existed {platform} platform""")
+
+    @staticmethod
+    def http_client(verify: bool = True) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            verify=verify,
+            http2=settings.LLM_HTTP2 and http2_available(),
+            limits=httpx.Limits(
+                max_connections=settings.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=settings.LLM_CONNECT_TIMEOUT),
+        )
+
+    @staticmethod
+    def create(platform: str, base_url: Optional[str]) -> AsyncOpenAI:
+        if platform == "OpenAI":
+            return AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=base_url,
+                               http_client=LLMClientRegistry.http_client())
+        return AsyncOpenAI(
+            base_url=base_url,
+            default_headers={"x-foo": "true"},
+            http_client=LLMClientRegistry.http_client(verify=False),
+        )
+
+    @staticmethod
+    def get(platform: str) -> AsyncOpenAI:
+        key = (platform, LLMClientRegistry.base_url(platform))
+        client = LLMClientRegistry._clients.get(key)
+        if client is None:
+            # Only the event loop thread creates clients: no lock needed
+            client = LLMClientRegistry._clients[key] = LLMClientRegistry.create(*key)
+        return client
+
+    @staticmethod
+    def startup() -> None:
+        for platform in ("OpenAI", "local"):
+            LLMClientRegistry.get(platform)
+
+    @staticmethod
+    async def close() -> None:
+        clients, LLMClientRegistry._clients = LLMClientRegistry._clients, {}
+        for (platform, _), client in clients.items():
+            try:
+                await client.close()
+            except Exception as e:
+                logging.getLogger('app').warning(f"Can't close {platform} LLM client: {e!r}")
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import random
+import time
+from typing import List, Optional
+
+import httpx
+
+from app.core.config import settings
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class EmbeddingClient(object):
+    """
+    Client of the embedding server (TEI `POST /embed`) on a pooled `httpx.AsyncClient`.
+
+    Texts are sent in batches, up to EM_CONCURRENCY requests in flight, with the batch size adapted to the server:
+        - 413 (batch over `--max-client-batch-size`): lower the ceiling to half the batch and split it
+        - 429/5xx/slow responses: halve the batch size, retry 429/5xx with jittered exponential backoff
+        - fast responses: grow the batch size by EM_BATCH_STEP (up to the ceiling)
+    `transport` is passed to httpx, e.g. `httpx.MockTransport` as an offline stub server.
+    The pooled client is bound to the event loop of its first request.
+    """
+
+    def __init__(self, base_url: str = None, batch_size: int = None, max_batch_size: int = None,
+                 concurrency: int = None, retries: int = None, target_latency: float = None,
+                 timeout: float = None, transport: httpx.AsyncBaseTransport = None):
+        self.base_url = base_url or settings.EM_URL
+        self.batch_size = batch_size or settings.EM_BATCH_SIZE
+        self.max_batch_size = max_batch_size or settings.EM_MAX_BATCH_SIZE
+        self.concurrency = concurrency or settings.EM_CONCURRENCY
+        self.retries = settings.EM_RETRIES if retries is None else retries
+        self.target_latency = target_latency or settings.EM_TARGET_LATENCY
+        self.timeout = timeout or settings.EM_TIMEOUT
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+        self.chunks = 0
+        self.requests = 0
+        self.retried = 0
+        self.seconds = 0.0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                transport=self.transport,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        cursor = 0
+        start = time.perf_counter()
+
+        async def worker():
+            # Next span is taken at the current (adapted) batch size; no await in between, no lock needed
+            nonlocal cursor
+            while cursor < len(texts):
+                begin, cursor = cursor, min(cursor + self.batch_size, len(texts))
+                await self._embed_span(texts, vectors, begin, cursor)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # On the first failure (or cancellation) stop the other workers instead of leaving them sending
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        self.chunks += len(texts)
+        self.seconds += time.perf_counter() - start
+        return vectors
+
+    async def _embed_span(self, texts: List[str], vectors: list, begin: int, end: int) -> None:
+        for attempt in range(self.retries + 1):
+            sent = time.perf_counter()
+            try:
+                response = await self.client.post("/embed", json={"inputs": texts[begin:end], "truncate": True})
+            except httpx.TransportError as e:
+                if attempt >= self.retries:
+                    raise
+                logging.getLogger('app').debug(f"Embedding request failed: {e!r}, retry")
+                await self._backoff(attempt)
+                continue
+            self.requests += 1
+            latency = time.perf_counter() - sent
+
+            if response.status_code == 413 and end - begin > 1:
+                # Server batch limit: never send that many again, split this one
+                self.max_batch_size = max(1, (end - begin) // 2)
+                self.batch_size = min(self.batch_size, self.max_batch_size)
+                mid = begin + (end - begin) // 2
+                await self._embed_span(texts, vectors, begin, mid)
+                await self._embed_span(texts, vectors, mid, end)
+                return
+            if response.status_code in RETRY_STATUS and attempt < self.retries:
+                self.batch_size = max(1, self.batch_size // 2)
+                await self._backoff(attempt, response.headers.get("retry-after"))
+                continue
+            response.raise_for_status()
+
+            vectors[begin:end] = response.json()
+            self._adapt(latency)
+            return
+
+    def _adapt(self, latency: float) -> None:
+        if latency > self.target_latency * 1.5:
+            self.batch_size = max(1, int(self.batch_size * 0.75))
+        elif latency < self.target_latency:
+            self.batch_size = min(self.max_batch_size, self.batch_size + settings.EM_BATCH_STEP)
+
+    async def _backoff(self, attempt: int, retry_after: str = None) -> None:
+        self.retried += 1
+        delay = random.uniform(0, min(settings.EM_BACKOFF_MAX, settings.EM_BACKOFF_BASE * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        await asyncio.sleep(delay)
+
+    def stats(self, since: dict = None) -> dict:
+        """Counters since `since` (a previous `stats()` of this client), since creation by default."""
+        since = since or {}
+        chunks = self.chunks - since.get("chunks", 0)
+        seconds = self.seconds - since.get("seconds", 0.0)
+        return {
+            "chunks": chunks,
+            "requests": self.requests - since.get("requests", 0),
+            "retries": self.retried - since.get("retries", 0),
+            "seconds": round(seconds, 3),
+            "chunks_per_second": round(chunks / seconds, 2) if seconds > 0 else 0.0,
+            "batch_size": self.batch_size,
+        }
+
@@ -0,0 +1,143 @@
+import logging
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional, Iterable
+
+from app.core.config import settings
+from app.helpers.llm.tokens import token_encoding
+
+INDEX_STRIDE = 256  # Byte offset kept every INDEX_STRIDE tokens
+INDEX_SUFFIX = ".idx"
+
+
+def lc_file_path(data_id: str) -> str:
+    return os.path.join(settings.WORKER_DIRECTORY, "chatdoc/lc", f"{data_id}.md")
+
+
+class TokenIndexBuilder(object):
+    """
+    o200k_base token -> byte offset index of a text written part by part.
+    Layout (`array('Q')`): [num_tokens, offset of token 0, offset of token INDEX_STRIDE, ...]
+    """
+
+    def __init__(self):
+        self.num_tokens = 0
+        self.num_bytes = 0
+        self.offsets = array("Q")
+
+    def add(self, text: str) -> None:
+        encoding = token_encoding()
+        for token in encoding.encode(text, disallowed_special=()):
+            if self.num_tokens % INDEX_STRIDE == 0:
+                self.offsets.append(self.num_bytes)
+            self.num_bytes += len(encoding.decode_single_token_bytes(token))
+            self.num_tokens += 1
+
+    def to_array(self) -> array:
+        return array("Q", [self.num_tokens]) + self.offsets
+
+    def save(self, file_name: str) -> None:
+        with open(file_name, "wb") as f:
+            self.to_array().tofile(f)
+
+
+class LCDocument(object):
+    """A memory mapped `.md` document with its token index."""
+
+    def __init__(self, file_name: str, index: array):
+        self.file_name = file_name
+        self.stat = os.stat(file_name)
+        with open(file_name, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.stat.st_size else b""
+        self.num_tokens = index[0]
+        self.offsets = index[1:]
+
+    def is_stale(self) -> bool:
+        try:
+            stat = os.stat(self.file_name)
+        except FileNotFoundError:
+            return True
+        return (stat.st_mtime_ns, stat.st_size) != (self.stat.st_mtime_ns, self.stat.st_size)
+
+    def text(self, max_tokens: Optional[int] = None) -> str:
+        """Whole document, or its first `max_tokens` tokens (rounded down to the index stride)."""
+        if max_tokens is None or max_tokens >= self.num_tokens:
+            end = len(self.data)
+        else:
+            end = self.offsets[max(0, max_tokens) // INDEX_STRIDE]
+        return self.data[:end].decode("utf-8", errors="ignore")
+
+
+class LCDocumentStore(object):
+    """
+    Long context documents (`chatdoc/lc/<data_id>.md`) saved with a token index (`<data_id>.md.idx`) at ingest,
+    served through mmap with an LRU of hot documents, so the chat path can slice a document to a token budget
+    without reading or encoding it.
+    """
+    __instance = None
+    _documents: "OrderedDict[str, LCDocument]" = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def save(data_id: str, parts: Iterable[str], separator: str = "") -> None:
+        file_name = lc_file_path(data_id)
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+        index = TokenIndexBuilder()
+        with open(file_name, 'w', encoding='utf-8') as f:
+            for i, part in enumerate(parts):
+                if i:
+                    f.write(separator)
+                    index.add(separator)
+                f.write(part)
+                index.add(part)
+        index.save(file_name + INDEX_SUFFIX)
+
+    @staticmethod
+    def delete(data_id: str) -> None:
+        file_name = lc_file_path(data_id)
+        for path in (file_name, file_name + INDEX_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+        with LCDocumentStore._lock:
+            LCDocumentStore._documents.pop(data_id, None)
+
+    @staticmethod
+    def load_index(file_name: str) -> array:
+        index_name = file_name + INDEX_SUFFIX
+        if os.path.exists(index_name) and os.path.getmtime(index_name) >= os.path.getmtime(file_name):
+            index = array("Q")
+            with open(index_name, "rb") as f:
+                index.frombytes(f.read())
+            return index
+
+        # Saved before the index existed: build it once
+        builder = TokenIndexBuilder()
+        with open(file_name, 'r', encoding='utf-8') as f:
+            builder.add(f.read())
+        try:
+            builder.save(index_name)
+        except OSError as e:
+            logging.getLogger('app').debug(f"Can't save token index '{index_name}': {e}")
+        return builder.to_array()
+
+    @staticmethod
+    def get(data_id: str) -> LCDocument:
+        with LCDocumentStore._lock:
+            document = LCDocumentStore._documents.get(data_id)
+            if document is not None and not document.is_stale():
+                LCDocumentStore._documents.move_to_end(data_id)
+                return document
+
+        file_name = lc_file_path(data_id)
+        document = LCDocument(file_name, LCDocumentStore.load_index(file_name))
+        with LCDocumentStore._lock:
+            LCDocumentStore._documents[data_id] = document
+            LCDocumentStore._documents.move_to_end(data_id)
+            # Evicted maps are closed when their last reader drops them
+            while len(LCDocumentStore._documents) > settings.LC_CACHE_SIZE:
+                LCDocumentStore._documents.popitem(last=False)
+        return document
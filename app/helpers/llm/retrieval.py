@@ -0,0 +1,177 @@
+import logging
+import re
+import zlib
+from collections import Counter
+from functools import lru_cache
+from typing import List, Tuple, Dict
+
+import httpx
+
+from app.core.config import settings
+from app.helpers.llm.tokens import count_tokens
+
+DENSE_VECTOR_NAME = ""  # Same names as `QdrantVectorStore`
+SPARSE_VECTOR_NAME = "langchain-sparse"
+CONTENT_KEY = "page_content"
+METADATA_KEY = "metadata"
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_AVG_LEN = 256
+
+
+class SparseEncoder(object):
+    """
+    BM25 term vectors for Qdrant sparse search: documents carry the saturated/length normalized term frequency,
+    queries carry 1 per term, and Qdrant applies the IDF (`Modifier.IDF`) from the collection statistics.
+    """
+    __instance = None
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        return TOKEN_PATTERN.findall(text.lower())
+
+    @staticmethod
+    def token_id(token: str) -> int:
+        return zlib.crc32(token.encode("utf-8")) & 0x7fffffff
+
+    @staticmethod
+    def encode_document(text: str) -> Tuple[List[int], List[float]]:
+        tokens = SparseEncoder.tokenize(text)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / BM25_AVG_LEN)
+        tfs = Counter(SparseEncoder.token_id(token) for token in tokens)
+        indices = list(tfs)
+        return indices, [tfs[i] * (BM25_K1 + 1) / (tfs[i] + norm) for i in indices]
+
+    @staticmethod
+    def encode_query(text: str) -> Tuple[List[int], List[float]]:
+        indices = list({SparseEncoder.token_id(token) for token in SparseEncoder.tokenize(text)})
+        return indices, [1.0] * len(indices)
+
+
+@lru_cache(maxsize=1)
+def qdrant_client():
+    from qdrant_client import QdrantClient
+
+    return QdrantClient(url=settings.VDB_URL, prefer_grpc=True)
+
+
+@lru_cache(maxsize=1)
+def query_embedding_client():
+    """Pooled client of the app's event loop, closed on shutdown (`close_query_embedding_client`)."""
+    from app.helpers.llm.embedding_client import EmbeddingClient
+
+    return EmbeddingClient()
+
+
+async def close_query_embedding_client() -> None:
+    if query_embedding_client.cache_info().currsize:
+        await query_embedding_client().aclose()
+        query_embedding_client.cache_clear()
+
+
+def message_text(message: dict) -> str:
+    content = message.get('content') or ""
+    if isinstance(content, list):
+        return "\n".join(part.get('text', "") for part in content if part.get('type') == "text")
+    return content
+
+
+class DocumentRetriever(object):
+    """
+    Retrieval of 'rag' collections:
+        dense top-k + BM25 top-k -> reciprocal rank fusion (in Qdrant) -> optional rerank -> context within a token budget
+    Collections without the sparse vector (embedded before it existed) are searched dense only.
+    """
+    _sparse: Dict[str, bool] = {}  # data_id -> has the sparse vector, shared by instances
+
+    def __init__(self, client=None, embedding_client=None):
+        self.client = client or qdrant_client()
+        self.embedding_client = embedding_client or query_embedding_client()
+
+    def has_sparse(self, data_id: str) -> bool:
+        if data_id not in self._sparse:
+            params = self.client.get_collection(data_id).config.params
+            self._sparse[data_id] = SPARSE_VECTOR_NAME in (params.sparse_vectors or {})
+        return self._sparse[data_id]
+
+    def search(self, data_id: str, query: str, dense: List[float], top_k: int = None) -> List[dict]:
+        """`dense`: embedding of `query`."""
+        from qdrant_client import models
+
+        top_k = top_k or settings.RAG_TOP_K
+        if self.has_sparse(data_id):
+            indices, values = SparseEncoder.encode_query(query)
+            response = self.client.query_points(
+                collection_name=data_id,
+                prefetch=[
+                    models.Prefetch(query=dense, using=DENSE_VECTOR_NAME, limit=top_k),
+                    models.Prefetch(query=models.SparseVector(indices=indices, values=values),
+                                    using=SPARSE_VECTOR_NAME, limit=top_k),
+                ],
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                limit=top_k,
+                with_payload=True,
+            )
+        else:
+            response = self.client.query_points(
+                collection_name=data_id, query=dense, using=DENSE_VECTOR_NAME, limit=top_k, with_payload=True)
+
+        return [
+            {
+                "text": point.payload.get(CONTENT_KEY) or "",
+                "metadata": point.payload.get(METADATA_KEY) or {},
+                "score": point.score,
+            }
+            for point in response.points
+        ]
+
+    @staticmethod
+    def rerank(query: str, hits: List[dict]) -> List[dict]:
+        """Cross-encoder rerank on the TEI reranker at RAG_RERANK_URL (e.g. CPU image), skipped when unset."""
+        if not settings.RAG_RERANK_URL or len(hits) <= 1:
+            return hits
+        try:
+            response = httpx.post(
+                f"{settings.RAG_RERANK_URL.rstrip('/')}/rerank",
+                json={"query": query, "texts": [hit["text"] for hit in hits], "truncate": True},
+                timeout=settings.EM_TIMEOUT,
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logging.getLogger('app').warning(f"Rerank failed, keep fusion order: {e!r}")
+            return hits
+        return [dict(hits[item["index"]], score=item["score"]) for item in response.json()]
+
+    @staticmethod
+    def build_context(hits: List[dict], token_budget: int = None) -> str:
+        """Best hits first, as long as they fit in `token_budget` tokens."""
+        token_budget = token_budget or settings.RAG_CONTEXT_TOKENS
+        parts, used = [], 0
+        for hit in hits:
+            if not hit["text"].strip():
+                continue
+            source = hit["metadata"].get("url") or hit["metadata"].get("filename") or ""
+            part = f"[{len(parts) + 1}] {source}\n{hit['text']}"
+            tokens = count_tokens(part)
+            if used + tokens > token_budget:
+                continue
+            parts.append(part)
+            used += tokens
+        return "\n\n---\n\n".join(parts)
+
+    def retrieve(self, data_id: str, query: str, dense: List[float], token_budget: int = None) -> str:
+        """Context of `query` (embedded as `dense`). Blocking (Qdrant, rerank, token counts)."""
+        hits = self.rerank(query, self.search(data_id, query, dense))
+        return self.build_context(hits, token_budget)
+
+    async def aretrieve(self, data_id: str, messages: list, token_budget: int = None) -> str:
+        """Context of the last user message: embedded on the pooled async client, the rest off the event loop."""
+        from starlette.concurrency import run_in_threadpool
+
+        query = next((message_text(m) for m in reversed(messages) if m.get('role') == "user"), "")
+        if not query.strip():
+            return ""
+        dense = (await self.embedding_client.embed([query]))[0]
+        return await run_in_threadpool(self.retrieve, data_id, query, dense, token_budget)
@@ -0,0 +1,85 @@
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime
+from typing import Optional, List
+
+from app.core.config import settings
+from app.helpers.llm.retrieval import message_text
+from app.mq_main import redis_async
+
+CACHE_KEY_PREFIX = "search_intent:"
+NO_SEARCH = {"web_browser_mode": False, "request": {}}
+
+# Small talk / tasks on the user's own text (en, vi): never need the web
+NO_SEARCH_PATTERN = re.compile(
+    r"^(hi|hello|hey|yo|ok|okay|thanks?|thank you|bye|good (morning|afternoon|evening|night)|"
+    r"xin chào|chào|chào bạn|alo|cảm ơn|cám ơn|tạm biệt|ừ|vâng|được|oke?)\b[\s\w]{0,20}$"
+    r"|^(translate|dịch|rewrite|viết lại|paraphrase|summari[sz]e|tóm tắt|fix|sửa|correct|proofread|format)\b"
+)
+# Real-time information, explicit browsing or links (en, vi): the LLM check will most likely enable search
+SEARCH_PATTERN = re.compile(
+    r"https?://|\b(search|google|browse|look up|links?|sources?|news|latest|today|tonight|yesterday|tomorrow|"
+    r"this (week|month|year)|current(ly)?|right now|price|weather|forecast|score|results?|"
+    r"tìm kiếm|tra cứu|tìm giúp|tin tức|mới nhất|hôm nay|hôm qua|ngày mai|tuần này|tháng này|năm nay|"
+    r"hiện (tại|nay)|bây giờ|giá|thời tiết|tỷ số|kết quả)\b"
+)
+YEAR_PATTERN = re.compile(r"\b(20[2-9]\d)\b")
+CODE_PATTERN = re.compile(r"```|^\s*[-+*/%^().\d\s=]+\s*$")
+KNOWLEDGE_CUTOFF_YEAR = 2023
+
+
+class SearchIntentClassifier(object):
+    """
+    Decide web browser mode without the LLM check when possible:
+        - `fast_path`: local rules on the last user message (False: no search, True: search likely, None: unknown)
+        - `cached`/`remember`: LLM decisions per normalized user turns, for the day (the check resolves dates)
+    """
+    __instance = None
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(re.sub(r"[^\w\s:/.%+-]", " ", text.lower()).split())
+
+    @staticmethod
+    def user_turns(messages: list) -> List[str]:
+        return [SearchIntentClassifier.normalize(message_text(m)) for m in messages if m.get('role') == "user"]
+
+    @staticmethod
+    def fast_path(messages: list) -> Optional[bool]:
+        turns = SearchIntentClassifier.user_turns(messages)
+        if not turns or not turns[-1]:
+            return False
+        query = turns[-1]
+        if SEARCH_PATTERN.search(query):
+            return True
+        if any(int(year) > KNOWLEDGE_CUTOFF_YEAR for year in YEAR_PATTERN.findall(query)):
+            return True
+        if NO_SEARCH_PATTERN.search(query) or CODE_PATTERN.search(message_text(messages[-1])):
+            return False
+        return None
+
+    @staticmethod
+    def cache_key(messages: list) -> str:
+        sha = hashlib.sha256(datetime.now().strftime("%Y-%m-%d").encode())
+        for turn in SearchIntentClassifier.user_turns(messages):
+            sha.update(b"\x00" + turn.encode("utf-8"))
+        return f"{CACHE_KEY_PREFIX}{sha.hexdigest()}"
+
+    @staticmethod
+    async def cached(messages: list) -> Optional[dict]:
+        try:
+            value = await redis_async.get(SearchIntentClassifier.cache_key(messages))
+        except Exception as e:
+            logging.getLogger('app').warning(f"Search intent cache unavailable: {e!r}")
+            return None
+        return json.loads(value) if value else None
+
+    @staticmethod
+    async def remember(messages: list, response: dict) -> None:
+        try:
+            await redis_async.set(SearchIntentClassifier.cache_key(messages), json.dumps(response),
+                                  ex=settings.SEARCH_INTENT_CACHE_TTL)
+        except Exception as e:
+            logging.getLogger('app').warning(f"Search intent cache unavailable: {e!r}")
@@ -0,0 +1,34 @@
+import asyncio
+from typing import AsyncIterator, Any
+
+_DONE = object()
+
+
+class SpeculativeStream(object):
+    """
+    Run an async generator ahead of its consumer, buffering what it yields, until the speculation is either
+    consumed (iterate it: buffered items first, then live ones) or `cancel`led.
+    """
+
+    def __init__(self, generator: AsyncIterator[Any]):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run(generator))
+
+    async def _run(self, generator: AsyncIterator[Any]) -> None:
+        try:
+            async for item in generator:
+                self.queue.put_nowait(item)
+        finally:
+            self.queue.put_nowait(_DONE)
+
+    async def cancel(self) -> None:
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+    async def __aiter__(self):
+        while True:
+            item = await self.queue.get()
+            if item is _DONE:
+                break
+            yield item
+        await self.task  # Raise its error, if any
@@ -0,0 +1,71 @@
+from functools import lru_cache
+from typing import Optional, Any, List
+
+ENCODING_NAME = "o200k_base"
+
+
+@lru_cache(maxsize=None)
+def token_encoding(encoding_name: str = ENCODING_NAME):
+    """One shared (thread safe) encoder per encoding, loaded on first use."""
+    import tiktoken
+
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return len(token_encoding().encode(text, disallowed_special=()))
+
+
+class TokenUsage(object):
+    """
+    Token usage of one completion.
+
+    The provider's `usage` (last stream chunk with `stream_options.include_usage`, or the completion response)
+    wins; otherwise streamed deltas are kept and the output (joined deltas) and input tokens are counted once,
+    at the end: tokens may span deltas, counting each delta would over-count.
+    """
+
+    def __init__(self):
+        self.input: Optional[int] = None
+        self.output: Optional[int] = None
+        self.from_provider = False
+        self._deltas: List[str] = []
+
+    def add_delta(self, text: str) -> None:
+        if not self.from_provider:
+            self._deltas.append(text)
+
+    def set_provider_usage(self, usage: Any) -> bool:
+        """`usage` object or dict of an OpenAI compatible response; return True when it has the counts."""
+        if usage is None:
+            return False
+        if not isinstance(usage, dict):
+            usage = {"prompt_tokens": getattr(usage, "prompt_tokens", None),
+                     "completion_tokens": getattr(usage, "completion_tokens", None)}
+        if usage.get("prompt_tokens") is None or usage.get("completion_tokens") is None:
+            return False
+        self.input, self.output, self.from_provider = usage["prompt_tokens"], usage["completion_tokens"], True
+        self._deltas = []
+        return True
+
+    def _count(self, prompt: str) -> None:
+        if self.input is None:
+            self.input = count_tokens(prompt)
+        if self.output is None:
+            self.output = count_tokens("".join(self._deltas))
+            self._deltas = []
+
+    def to_dict(self, prompt: str) -> dict:
+        """`prompt` and the deltas are only encoded when the provider didn't report usage."""
+        self._count(prompt)
+        return {"input": self.input, "output": self.output}
+
+    async def ato_dict(self, prompt: str) -> dict:
+        """`to_dict`, encoding (CPU bound) off the event loop."""
+        from starlette.concurrency import run_in_threadpool
+
+        if self.input is None or self.output is None:
+            await run_in_threadpool(self._count, prompt)
+        return {"input": self.input, "output": self.output}
@@ -1,11 +1,17 @@
 from fastapi import HTTPException, Depends
 
-from app.models import User
-from app.services.user import UserService
+from app.core.config import settings
+from app.schemas.user import UserItemResponse
+from app.services.user import UserService, AsyncUserService
 
 
-def login_required(http_authorization_credentials=Depends(UserService().reusable_oauth2)):
-    return UserService().get_current_user(http_authorization_credentials)
+if settings.DB_ASYNC:
+    async def login_required(
+            http_authorization_credentials=Depends(UserService().reusable_oauth2)) -> UserItemResponse:
+        return await AsyncUserService.get_current_principal(http_authorization_credentials)
+else:
+    def login_required(http_authorization_credentials=Depends(UserService().reusable_oauth2)) -> UserItemResponse:
+        return UserService().get_current_principal(http_authorization_credentials)
 
 
 class PermissionRequired:
@@ -13,8 +19,8 @@ class PermissionRequired:
         self.user = None
         self.permissions = args
 
-    def __call__(self, user: User = Depends(login_required)):
+    def __call__(self, user: UserItemResponse = Depends(login_required)):
         self.user = user
         if self.user.role not in self.permissions and self.permissions:
             raise HTTPException(status_code=400,
-                                detail=f'User {self.user.email} can not access this api')
+                                detail=f'User {self.user.username} can not access this api')
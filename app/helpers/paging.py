@@ -1,14 +1,19 @@
+import base64
+import binascii
+import json
 import logging
+from datetime import date, datetime
 from pydantic import BaseModel, conint
 from abc import ABC, abstractmethod
-from typing import Optional, Generic, Sequence, Type, TypeVar
+from typing import Optional, Generic, Sequence, Type, TypeVar, Literal, Tuple, List, Any
 
-from sqlalchemy import asc, desc
+from sqlalchemy import asc, desc, text, tuple_
 from sqlalchemy.orm import Query
+from sqlalchemy.sql.elements import TextClause
 from pydantic.generics import GenericModel
 from contextvars import ContextVar
 
-from app.schemas.base import ResponseSchemaBase, MetadataSchema
+from app.schemas.base import ResponseSchemaBase, MetadataSchema, CursorMetadataSchema
 from app.helpers.exception_handler import CustomException
 
 T = TypeVar("T")
@@ -49,6 +54,27 @@ class Page(BasePage[T], Generic[T]):
         )
 
 
+class CursorParams(BaseModel):
+    page_size: Optional[conint(gt=0, lt=1001)] = 10
+    cursor: Optional[str] = None  # next_cursor/prev_cursor of the previous response, first page when empty
+    sort_by: Optional[str] = 'id'
+    order: Optional[Literal['asc', 'desc']] = 'desc'
+    total: Optional[Literal['exact', 'estimate', 'none']] = 'none'
+
+
+class CursorPage(BasePage[T], Generic[T]):
+    metadata: CursorMetadataSchema
+
+    @classmethod
+    def create(cls, code: str, message: str, data: Sequence[T], metadata: CursorMetadataSchema) -> "CursorPage[T]":
+        return cls(
+            code=code,
+            message=message,
+            data=data,
+            metadata=metadata
+        )
+
+
 PageType: ContextVar[Type[BasePage]] = ContextVar("PageType", default=Page)
 
 
@@ -75,3 +101,96 @@ def paginate(model, query: Query, params: Optional[PaginationParams]) -> BasePag
         raise CustomException(http_code=500, code='500', message=str(e))
 
     return PageType.get().create(code, message, data, metadata)
+
+
+# Keyset pagination: rows after/before the (sort_by, id) of a cursor, cost independent of the page depth.
+# `sort_by` must be one of the `sortable` columns given by the route: NOT NULL, and fine to expose in cursors.
+
+def encode_cursor(params: CursorParams, row, direction: str) -> str:
+    value = getattr(row, params.sort_by)
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    data = {"s": params.sort_by, "o": params.order, "d": direction, "v": value, "id": row.id}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(model, params: CursorParams) -> Tuple[str, Any, Any]:
+    """Return (direction, sort value, id) of `params.cursor`."""
+    try:
+        cursor = params.cursor + "=" * (-len(params.cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if data["s"] != params.sort_by or data["o"] != params.order or data["d"] not in ("next", "prev"):
+            raise ValueError("cursor of another listing")
+        value = data["v"]
+        python_type = getattr(model, params.sort_by).type.python_type
+        if python_type in (datetime, date) and value is not None:
+            value = python_type.fromisoformat(value)
+        return data["d"], value, data["id"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError, NotImplementedError) as e:
+        raise CustomException(http_code=400, code='400', message=f"Invalid cursor: {e}")
+
+
+def cursor_clauses(model, params: CursorParams, sortable: Sequence[str] = ('id',)) -> Tuple[str, list, list]:
+    """Return (direction, where clauses, order by) of the page requested by `params`."""
+    if params.sort_by not in sortable:
+        raise CustomException(http_code=400, code='400', message=f"Can't sort by '{params.sort_by}'")
+    column, id_column = getattr(model, params.sort_by), model.id
+    keys = [id_column] if params.sort_by == 'id' else [column, id_column]
+
+    direction, where = "next", []
+    if params.cursor:
+        direction, value, row_id = decode_cursor(model, params)
+        bound = tuple_(*keys) if len(keys) > 1 else id_column
+        values = tuple_(value, row_id) if len(keys) > 1 else row_id
+        # 'prev' walks backwards: reversed order, rows reversed back after the query
+        forward = (params.order == 'desc') == (direction == "next")
+        where.append(bound < values if forward else bound > values)
+
+    descending = (params.order == 'desc') == (direction == "next")
+    order_by = [desc(key) if descending else asc(key) for key in keys]
+    return direction, where, order_by
+
+
+def cursor_page(params: CursorParams, direction: str, rows: List, total: Optional[int], estimated: bool) -> BasePage:
+    has_more = len(rows) > params.page_size
+    rows = rows[:params.page_size]
+    if direction == "prev":
+        rows.reverse()
+    has_next = has_more if direction == "next" else True
+    has_prev = bool(params.cursor) if direction == "next" else has_more
+
+    metadata = CursorMetadataSchema(
+        page_size=params.page_size,
+        next_cursor=encode_cursor(params, rows[-1], "next") if rows and has_next else None,
+        prev_cursor=encode_cursor(params, rows[0], "prev") if rows and has_prev else None,
+        total_items=total,
+        total_estimated=estimated,
+    )
+    return CursorPage.create('200', 'Success', rows, metadata)
+
+
+def estimated_count_query(model) -> TextClause:
+    """Table size from the planner statistics (`pg_class.reltuples`, -1 before the first ANALYZE)."""
+    return text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)").bindparams(
+        table=model.__tablename__)
+
+
+def cursor_paginate(model, query: Query, params: CursorParams, sortable: Sequence[str] = ('id',)) -> BasePage:
+    """
+    Keyset pagination of `query` on (sort_by, id) with opaque next/prev cursors, `sort_by` one of `sortable`.
+    `params.total`: 'exact' (count query), 'estimate' (whole table, planner statistics) or 'none'.
+    """
+    direction, where, order_by = cursor_clauses(model, params, sortable)
+    try:
+        total, estimated = None, params.total == 'estimate'
+        if params.total == 'exact':
+            total = query.order_by(None).count()
+        elif estimated:
+            total = query.session.execute(estimated_count_query(model)).scalar()
+            total = total if total is not None and total >= 0 else None
+
+        rows = query.filter(*where).order_by(None).order_by(*order_by).limit(params.page_size + 1).all()
+    except Exception as e:
+        raise CustomException(http_code=500, code='500', message=str(e))
+
+    return cursor_page(params, direction, rows, total, estimated)
@@ -0,0 +1,195 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict
+
+from app.core.config import settings
+from app.mq_main import redis, redis_async
+from app.schemas.user import UserItemResponse
+
+KEY_PREFIX = "auth:principal:"  # user_id -> hash(token fingerprint -> principal)
+GENERATION_KEY_PREFIX = "auth:principal_gen:"  # user_id -> counter bumped by `invalidate`
+
+# Cache a principal unless the user was invalidated since it was read from the database.
+# KEYS[1]: principals hash, KEYS[2]: generation key
+# ARGV[1]: generation read before the database ('' when unset), ARGV[2]: fingerprint, ARGV[3]: principal, ARGV[4]: ttl
+PUT_SCRIPT = """
+local generation = redis.call('GET', KEYS[2]) or ''
+if generation ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+_put = redis.register_script(PUT_SCRIPT)
+_put_async = redis_async.register_script(PUT_SCRIPT)
+
+Generation = Tuple[int, Optional[str]]  # (this process, Redis)
+
+
+def token_fingerprint(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+class PrincipalCache(object):
+    """
+    Authenticated users (`UserItemResponse`) by (user_id, token fingerprint): TTL LRU in process, then Redis,
+    then the database (`a*`: same on the async redis client). `invalidate` (user updated/deactivated) clears both tiers of this process and Redis;
+    other app processes drop their copy within AUTH_CACHE_TTL.
+
+    `invalidate` also bumps a per-user generation, and `put` only stores a principal if the generation is still the
+    one read (`generation`) before loading the user: a request that loaded the user before an update can't cache
+    the old row after the update's `invalidate`.
+    """
+    __instance = None
+    _entries: "OrderedDict[Tuple[int, str], Tuple[float, UserItemResponse]]" = OrderedDict()
+    _generations: Dict[int, int] = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_local(key: Tuple[int, str]) -> Optional[UserItemResponse]:
+        with PrincipalCache._lock:
+            entry = PrincipalCache._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    PrincipalCache._entries.move_to_end(key)
+                    return entry[1]
+                del PrincipalCache._entries[key]
+        return None
+
+    @staticmethod
+    def get(user_id: int, fingerprint: str) -> Optional[UserItemResponse]:
+        principal = PrincipalCache.get_local((user_id, fingerprint))
+        if principal is not None or not settings.AUTH_CACHE_REDIS:
+            return principal
+        generation = PrincipalCache.local_generation(user_id)
+        try:
+            value = redis.hget(f"{KEY_PREFIX}{user_id}", fingerprint)
+        except Exception as e:
+            logging.getLogger('app').warning(f"Principal cache unavailable: {e!r}")
+            return None
+        if value is None:
+            return None
+        principal = UserItemResponse.parse_raw(value)
+        PrincipalCache.put_local((user_id, fingerprint), principal, generation)
+        return principal
+
+    @staticmethod
+    async def aget(user_id: int, fingerprint: str) -> Optional[UserItemResponse]:
+        principal = PrincipalCache.get_local((user_id, fingerprint))
+        if principal is not None or not settings.AUTH_CACHE_REDIS:
+            return principal
+        generation = PrincipalCache.local_generation(user_id)
+        try:
+            value = await redis_async.hget(f"{KEY_PREFIX}{user_id}", fingerprint)
+        except Exception as e:
+            logging.getLogger('app').warning(f"Principal cache unavailable: {e!r}")
+            return None
+        if value is None:
+            return None
+        principal = UserItemResponse.parse_raw(value)
+        PrincipalCache.put_local((user_id, fingerprint), principal, generation)
+        return principal
+
+    @staticmethod
+    def local_generation(user_id: int) -> int:
+        with PrincipalCache._lock:
+            return PrincipalCache._generations.get(user_id, 0)
+
+    @staticmethod
+    def generation(user_id: int) -> Generation:
+        """Read before loading the user from the database, then passed to `put`."""
+        generation = PrincipalCache.local_generation(user_id)
+        if not settings.AUTH_CACHE_REDIS:
+            return generation, None
+        try:
+            value = redis.get(f"{GENERATION_KEY_PREFIX}{user_id}")
+        except Exception as e:
+            logging.getLogger('app').warning(f"Principal cache unavailable: {e!r}")
+            return generation, None
+        return generation, value.decode() if value is not None else ""
+
+    @staticmethod
+    async def ageneration(user_id: int) -> Generation:
+        generation = PrincipalCache.local_generation(user_id)
+        if not settings.AUTH_CACHE_REDIS:
+            return generation, None
+        try:
+            value = await redis_async.get(f"{GENERATION_KEY_PREFIX}{user_id}")
+        except Exception as e:
+            logging.getLogger('app').warning(f"Principal cache unavailable: {e!r}")
+            return generation, None
+        return generation, value.decode() if value is not None else ""
+
+    @staticmethod
+    def put_local(key: Tuple[int, str], principal: UserItemResponse, generation: int) -> None:
+        with PrincipalCache._lock:
+            if PrincipalCache._generations.get(key[0], 0) != generation:
+                return
+            PrincipalCache._entries[key] = (time.monotonic() + settings.AUTH_CACHE_TTL, principal)
+            PrincipalCache._entries.move_to_end(key)
+            while len(PrincipalCache._entries) > settings.AUTH_CACHE_SIZE:
+                PrincipalCache._entries.popitem(last=False)
+
+    @staticmethod
+    def put(user_id: int, fingerprint: str, principal: UserItemResponse, generation: Generation) -> None:
+        PrincipalCache.put_local((user_id, fingerprint), principal, generation[0])
+        if not settings.AUTH_CACHE_REDIS or generation[1] is None:
+            return
+        try:
+            _put(keys=[f"{KEY_PREFIX}{user_id}", f"{GENERATION_KEY_PREFIX}{user_id}"],
+                 args=[generation[1], fingerprint, principal.json(), settings.AUTH_CACHE_REDIS_TTL])
+        except Exception as e:
+            logging.getLogger('app').warning(f"Principal cache unavailable: {e!r}")
+
+    @staticmethod
+    async def aput(user_id: int, fingerprint: str, principal: UserItemResponse, generation: Generation) -> None:
+        PrincipalCache.put_local((user_id, fingerprint), principal, generation[0])
+        if not settings.AUTH_CACHE_REDIS or generation[1] is None:
+            return
+        try:
+            await _put_async(keys=[f"{KEY_PREFIX}{user_id}", f"{GENERATION_KEY_PREFIX}{user_id}"],
+                             args=[generation[1], fingerprint, principal.json(), settings.AUTH_CACHE_REDIS_TTL])
+        except Exception as e:
+            logging.getLogger('app').warning(f"Principal cache unavailable: {e!r}")
+
+    @staticmethod
+    def invalidate_local(user_id: int) -> None:
+        with PrincipalCache._lock:
+            PrincipalCache._generations[user_id] = PrincipalCache._generations.get(user_id, 0) + 1
+            for key in [key for key in PrincipalCache._entries if key[0] == user_id]:
+                del PrincipalCache._entries[key]
+
+    @staticmethod
+    def invalidate(user_id: int) -> None:
+        PrincipalCache.invalidate_local(user_id)
+        if not settings.AUTH_CACHE_REDIS:
+            return
+        try:
+            pipe = redis.pipeline(transaction=True)
+            pipe.incr(f"{GENERATION_KEY_PREFIX}{user_id}")
+            # Outlives any put that could have read the previous generation
+            pipe.expire(f"{GENERATION_KEY_PREFIX}{user_id}", settings.AUTH_CACHE_REDIS_TTL)
+            pipe.delete(f"{KEY_PREFIX}{user_id}")
+            pipe.execute()
+        except Exception as e:
+            logging.getLogger('app').warning(f"Principal cache unavailable: {e!r}")
+
+    @staticmethod
+    async def ainvalidate(user_id: int) -> None:
+        PrincipalCache.invalidate_local(user_id)
+        if not settings.AUTH_CACHE_REDIS:
+            return
+        try:
+            pipe = redis_async.pipeline(transaction=True)
+            pipe.incr(f"{GENERATION_KEY_PREFIX}{user_id}")
+            # Outlives any put that could have read the previous generation
+            pipe.expire(f"{GENERATION_KEY_PREFIX}{user_id}", settings.AUTH_CACHE_REDIS_TTL)
+            pipe.delete(f"{KEY_PREFIX}{user_id}")
+            await pipe.execute()
+        except Exception as e:
+            logging.getLogger('app').warning(f"Principal cache unavailable: {e!r}")
@@ -0,0 +1,94 @@
+import logging
+import time
+
+from app.core.config import settings
+from app.mq_main import redis, redis_async, celery_execute
+
+CANCELLED_KEY = "tasks_cancelled"
+CANCELLED_EXPIRY_KEY = "tasks_cancelled:expiry"
+PURGE_BATCH = 500
+
+# Drop members whose expiry (score) has passed.
+# KEYS[1]: set, KEYS[2]: expiry sorted set
+# ARGV[1]: now, ARGV[2]: batch size
+PURGE_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #expired > 0 then
+    redis.call('SREM', KEYS[1], unpack(expired))
+    redis.call('ZREM', KEYS[2], unpack(expired))
+end
+return #expired
+"""
+
+_purge = redis.register_script(PURGE_SCRIPT)
+_purge_async = redis_async.register_script(PURGE_SCRIPT)
+
+
+class TaskKilled(ValueError):
+    pass
+
+
+def revoke(task_id: str) -> None:
+    """Drop it at the broker/worker if not consumed yet."""
+    try:
+        celery_execute.control.revoke(task_id)
+    except Exception as e:
+        logging.getLogger('app').debug(e, exc_info=True)
+
+
+class TaskCancellation(object):
+    """
+    Cancelled task ids kept in a redis SET (O(1) check) with per-member expiry tracked in a sorted set.
+    """
+    __instance = None
+
+    @staticmethod
+    def cancel(task_id: str) -> None:
+        pipe = redis.pipeline(transaction=True)
+        pipe.sadd(CANCELLED_KEY, task_id)
+        pipe.zadd(CANCELLED_EXPIRY_KEY, {task_id: time.time() + settings.QUEUE_RESULT_EXPIRES})
+        pipe.execute()
+        TaskCancellation.purge_expired()
+
+        revoke(task_id)
+
+    @staticmethod
+    def is_cancelled(task_id: str) -> bool:
+        return bool(redis.sismember(CANCELLED_KEY, task_id))
+
+    @staticmethod
+    def acknowledge(task_id: str) -> None:
+        pipe = redis.pipeline(transaction=True)
+        pipe.srem(CANCELLED_KEY, task_id)
+        pipe.zrem(CANCELLED_EXPIRY_KEY, task_id)
+        pipe.execute()
+
+    @staticmethod
+    def purge_expired() -> int:
+        return _purge(keys=[CANCELLED_KEY, CANCELLED_EXPIRY_KEY], args=[time.time(), PURGE_BATCH])
+
+    @staticmethod
+    def check(task_id: str) -> None:
+        """Cooperative cancellation point for workers."""
+        if TaskCancellation.is_cancelled(task_id):
+            TaskCancellation.acknowledge(task_id)
+            raise TaskKilled("Task killed!")
+
+
+class AsyncTaskCancellation(object):
+    """`TaskCancellation.cancel` for async routes."""
+    __instance = None
+
+    @staticmethod
+    async def cancel(task_id: str) -> None:
+        # Imported here: the worker image has no starlette
+        from starlette.concurrency import run_in_threadpool
+
+        pipe = redis_async.pipeline(transaction=True)
+        pipe.sadd(CANCELLED_KEY, task_id)
+        pipe.zadd(CANCELLED_EXPIRY_KEY, {task_id: time.time() + settings.QUEUE_RESULT_EXPIRES})
+        await pipe.execute()
+        await _purge_async(keys=[CANCELLED_KEY, CANCELLED_EXPIRY_KEY], args=[time.time(), PURGE_BATCH])
+
+        # Broadcast goes through the sync kombu producer
+        await run_in_threadpool(revoke, task_id)
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional, List
+
+from kombu import Connection, pools
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.mq_main import redis
+
+SNAPSHOT_KEY = "queue_depth:snapshot"
+LEADER_KEY = "queue_depth:leader"
+
+
+class QueueDepthSampler(object):
+    """
+    Queue depth snapshot refreshed in background, status polls only read it.
+
+    One process per interval (redis lock) samples RabbitMQ with a passive `queue_declare` on a pooled
+    connection and shares the result in redis; every process keeps a local copy.
+    """
+    __instance = None
+    _snapshot: Optional[dict] = None
+
+    @staticmethod
+    def queues() -> List[str]:
+        return settings.QUEUE_DEPTH_QUEUES or [settings.WORKER_NAME]
+
+    @staticmethod
+    def sample() -> dict:
+        queues = []
+        with pools.connections[Connection(settings.RABBITMQ_BROKER)].acquire(block=True, timeout=5) as conn:
+            for name in QueueDepthSampler.queues():
+                channel = conn.channel()
+                try:
+                    _, message_count, consumer_count = channel.queue_declare(queue=name, passive=True)
+                    queues.append({"name": name, "num_task_queueing": message_count, "num_consumer": consumer_count})
+                except Exception as e:
+                    logging.getLogger('app').debug(f"Can't declare queue '{name}': {e}")
+                finally:
+                    try:
+                        channel.close()
+                    except Exception:
+                        pass
+
+        return {"queues": queues, "sampled_at": time.time()}
+
+    @staticmethod
+    def refresh() -> Optional[dict]:
+        interval = settings.QUEUE_DEPTH_INTERVAL
+        if redis.set(LEADER_KEY, "1", nx=True, ex=interval):
+            snapshot = QueueDepthSampler.sample()
+            redis.set(SNAPSHOT_KEY, json.dumps(snapshot), ex=interval * 10)
+        else:
+            data = redis.get(SNAPSHOT_KEY)
+            snapshot = json.loads(data) if data else None
+
+        QueueDepthSampler._snapshot = snapshot
+        return snapshot
+
+    @staticmethod
+    def snapshot() -> Optional[dict]:
+        snapshot = QueueDepthSampler._snapshot
+        if snapshot is None:
+            return None
+        return dict(snapshot, staleness=round(time.time() - snapshot["sampled_at"], 3))
+
+    @staticmethod
+    async def run():
+        while True:
+            try:
+                await run_in_threadpool(QueueDepthSampler.refresh)
+            except Exception as e:
+                logging.getLogger('app').debug(e, exc_info=True)
+            await asyncio.sleep(settings.QUEUE_DEPTH_INTERVAL)
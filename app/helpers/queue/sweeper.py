@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from app.core.config import settings
+from app.helpers.queue.task_state import AsyncTaskStateStore, Transition, DEADLINES_KEY, is_finished
+from app.mq_main import redis_async
+
+LEADER_KEY = "tasks_deadlines:leader"
+
+
+class TaskDeadlineSweeper(object):
+    """
+    Marks overdue tasks in background, so status reads are pure lookups:
+        - PENDING > QUEUE_TIMEOUT -> TIMEOUT (never reached a worker)
+        - STARTED > QUEUE_TIME_LIMIT * 2 -> TIMELIMIT (worker maybe dead when processing)
+
+    Scans `tasks_deadlines` (sorted by deadline), one process per interval (redis lock).
+    """
+    __instance = None
+
+    @staticmethod
+    async def sweep() -> int:
+        """Handle one batch of overdue tasks, return the batch size."""
+        now = datetime.utcnow().timestamp()
+        task_ids = [
+            task_id.decode() for task_id in
+            await redis_async.zrangebyscore(DEADLINES_KEY, "-inf", now, start=0, num=settings.QUEUE_SWEEP_BATCH)
+        ]
+        if not task_ids:
+            return 0
+
+        transitions, stale = [], []
+        for task_id, message in zip(task_ids, await AsyncTaskStateStore.get_many(task_ids)):
+            if message is None or is_finished(message):
+                stale.append(task_id)
+            elif message["status"]["general_status"] == "PENDING":
+                logging.getLogger('app').debug(f"{task_id}: Worker is don't working, or queue time out!")
+                transitions.append((task_id, *Transition.timeout()))
+            elif message["status"]["general_status"] == "SUCCESS" and message["status"]["task_status"] == "STARTED":
+                logging.getLogger('app').debug(f"{task_id}: Task failed after work, maybe worker dead when processing")
+                transitions.append((task_id, *Transition.timelimit()))
+            else:
+                stale.append(task_id)
+
+        # Transitions drop their own deadline (or move it, if the task just started)
+        if transitions:
+            await AsyncTaskStateStore.transition_many(transitions)
+        if stale:
+            await redis_async.zrem(DEADLINES_KEY, *stale)
+
+        return len(task_ids)
+
+    @staticmethod
+    async def run():
+        interval = settings.QUEUE_SWEEP_INTERVAL
+        while True:
+            try:
+                if await redis_async.set(LEADER_KEY, "1", nx=True, ex=interval):
+                    while await TaskDeadlineSweeper.sweep() >= settings.QUEUE_SWEEP_BATCH:
+                        pass
+            except Exception as e:
+                logging.getLogger('app').debug(e, exc_info=True)
+            await asyncio.sleep(interval)
@@ -0,0 +1,295 @@
+import json
+from datetime import datetime
+from typing import Optional, Dict, List, Any, Union, Tuple
+
+from app.core.config import settings
+from app.mq_main import redis, redis_async
+
+TASK_KEY_PREFIX = "task:"
+TASK_CHANNEL_SUFFIX = ":events"
+DEADLINES_KEY = "tasks_deadlines"  # sorted set: task_id -> timestamp it must have moved on by
+
+# Nested layout of `QueueResult` -> flat hash fields
+STATUS_FIELDS = ("general_status", "task_status")
+TIME_FIELDS = ("start_generate", "end_generate")
+JSON_FIELDS = ("task_result", "error")
+
+FINISHED_GENERAL_STATUS = ("FAILED", "TIMEOUT", "TIMELIMIT", "KILLED")
+FINISHED_TASK_STATUS = ("SUCCESS", "FAILED")
+
+# Compare-and-set on hash fields, reschedule its deadline, then publish the new state.
+# KEYS[1]: task key, KEYS[2]: deadlines
+# ARGV[1]: ttl, ARGV[2]: guard {field: [allowed values]}, ARGV[3]: updates {field: value}, ARGV[4]: channel,
+# ARGV[5]: deadline ('' keep, '-' remove, '<seconds>' started_at (now if unset) + seconds),
+# ARGV[6]: task_id, ARGV[7]: now
+TRANSITION_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local guard = cjson.decode(ARGV[2])
+for field, allowed in pairs(guard) do
+    local current = redis.call('HGET', KEYS[1], field) or ''
+    local matched = false
+    for _, value in ipairs(allowed) do
+        if current == value then
+            matched = true
+            break
+        end
+    end
+    if not matched then
+        return 0
+    end
+end
+local updates = cjson.decode(ARGV[3])
+for field, value in pairs(updates) do
+    redis.call('HSET', KEYS[1], field, value)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+if ARGV[5] == '-' then
+    redis.call('ZREM', KEYS[2], ARGV[6])
+elseif ARGV[5] ~= '' then
+    local start = tonumber(redis.call('HGET', KEYS[1], 'started_at')) or tonumber(ARGV[7])
+    redis.call('ZADD', KEYS[2], start + tonumber(ARGV[5]), ARGV[6])
+end
+redis.call('PUBLISH', ARGV[4], cjson.encode(redis.call('HGETALL', KEYS[1])))
+return 1
+"""
+
+_transition = redis.register_script(TRANSITION_SCRIPT)
+_transition_async = redis_async.register_script(TRANSITION_SCRIPT)
+
+
+def task_key(task_id: str) -> str:
+    return f"{TASK_KEY_PREFIX}{task_id}"
+
+
+def task_channel(task_id: str) -> str:
+    return f"{TASK_KEY_PREFIX}{task_id}{TASK_CHANNEL_SUFFIX}"
+
+
+def utc_timestamp() -> str:
+    return str(datetime.utcnow().timestamp())
+
+
+def dump_fields(fields: Dict[str, Any]) -> Dict[str, str]:
+    """Serialize values for a redis hash ('' stands for None)."""
+    dumped = {}
+    for field, value in fields.items():
+        if field in JSON_FIELDS:
+            dumped[field] = "" if value is None else json.dumps(value)
+        else:
+            dumped[field] = "" if value is None else str(value)
+    return dumped
+
+
+def to_message(raw: Union[Dict, List]) -> Optional[dict]:
+    """Rebuild the `QueueResult` shaped message from a redis hash (dict or flat [field, value, ...] list)."""
+    if not raw:
+        return None
+    if isinstance(raw, list):
+        raw = dict(zip(raw[::2], raw[1::2]))
+
+    fields = {}
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        value = value.decode() if isinstance(value, bytes) else value
+        fields[field] = value or None
+
+    return {
+        "task_id": fields.get("task_id") or "",
+        "status": {field: fields.get(field) for field in STATUS_FIELDS},
+        "time": {field: fields.get(field) for field in TIME_FIELDS},
+        "queue": None,
+        "task_result": json.loads(fields["task_result"]) if fields.get("task_result") else None,
+        "error": json.loads(fields["error"]) if fields.get("error") else None,
+    }
+
+
+def create_fields(task_id: str, data: dict) -> Dict[str, str]:
+    fields = {"task_id": task_id}
+    fields.update({field: (data.get('status') or {}).get(field) for field in STATUS_FIELDS})
+    fields.update({field: (data.get('time') or {}).get(field) for field in TIME_FIELDS})
+    fields.update({field: data.get(field) for field in JSON_FIELDS})
+    return dump_fields(fields)
+
+
+def transition_keys(task_id: str) -> list:
+    return [task_key(task_id), DEADLINES_KEY]
+
+
+def transition_args(task_id: str, updates: Dict[str, Any], guard: Dict[str, List[Optional[str]]] = None,
+                    deadline: str = "") -> list:
+    guard = {field: ["" if v is None else v for v in allowed] for field, allowed in (guard or {}).items()}
+    return [settings.QUEUE_RESULT_EXPIRES, json.dumps(guard), json.dumps(dump_fields(updates)), task_channel(task_id),
+            deadline, task_id, datetime.utcnow().timestamp()]
+
+
+def create_deadline(fields: Dict[str, str]) -> float:
+    start = float(fields["start_generate"] or datetime.utcnow().timestamp())
+    return start + float(settings.QUEUE_TIMEOUT)
+
+
+def is_finished(message: dict) -> bool:
+    return (message["status"]["general_status"] in FINISHED_GENERAL_STATUS
+            or message["status"]["task_status"] in FINISHED_TASK_STATUS)
+
+
+class Transition(object):
+    """
+    (updates, guard, deadline) of every status transition.
+
+    Deadlines (swept by `TaskDeadlineSweeper`):
+        - PENDING: start_generate + QUEUE_TIMEOUT (set on create)
+        - STARTED: started_at (set by the transition, not part of the message) + QUEUE_TIME_LIMIT * 2
+        - otherwise: none
+    """
+    __instance = None
+
+    # Worker
+    @staticmethod
+    def started() -> Tuple[dict, dict, str]:
+        return ({"general_status": "SUCCESS", "task_status": "STARTED", "started_at": utc_timestamp()},
+                {"general_status": ["PENDING"]},
+                str(float(settings.QUEUE_TIME_LIMIT) * 2))
+
+    @staticmethod
+    def success(response: dict) -> Tuple[dict, dict, str]:
+        return ({"task_status": "SUCCESS", "end_generate": utc_timestamp(), "task_result": response},
+                {"general_status": ["SUCCESS"], "task_status": ["STARTED"]},
+                "-")
+
+    @staticmethod
+    def failed(err: dict) -> Tuple[dict, dict, str]:
+        return ({"task_status": "FAILED", "end_generate": utc_timestamp(), "error": err},
+                {"general_status": ["SUCCESS"], "task_status": ["STARTED"]},
+                "-")
+
+    # App
+    @staticmethod
+    def rejected(err: dict) -> Tuple[dict, dict, str]:
+        """Task couldn't be sent to the broker."""
+        return ({"general_status": "FAILED", "error": err},
+                {"general_status": ["PENDING"]},
+                "-")
+
+    @staticmethod
+    def killed() -> Tuple[dict, dict, str]:
+        """Pending or still running task."""
+        return ({"general_status": "KILLED", "end_generate": utc_timestamp(),
+                 "error": {'code': "200", 'message': "Task Killed!"}},
+                {"general_status": ["PENDING", "SUCCESS"], "task_status": [None, "STARTED"]},
+                "-")
+
+    @staticmethod
+    def timeout() -> Tuple[dict, dict, str]:
+        """Still PENDING after QUEUE_TIMEOUT (never reached a worker)."""
+        return ({"general_status": "TIMEOUT", "end_generate": utc_timestamp(),
+                 "error": {'code': "500", 'message': "Internal Server Error!"}},
+                {"general_status": ["PENDING"]},
+                "-")
+
+    @staticmethod
+    def timelimit() -> Tuple[dict, dict, str]:
+        """Started but never finished (worker probably died while processing)."""
+        return ({"general_status": "TIMELIMIT", "end_generate": utc_timestamp(),
+                 "error": {'code': "500", 'message': "Internal Server Error!"}},
+                {"general_status": ["SUCCESS"], "task_status": ["STARTED"]},
+                "-")
+
+
+class TaskStateStore(object):
+    """
+    Task status stored as a redis hash `task:<task_id>`, shared by app and worker.
+
+    Every write is a single guarded transition so concurrent writers (API, worker) can't lose updates,
+    and is published on `task:<task_id>:events` for subscribers.
+    """
+    __instance = None
+
+    @staticmethod
+    def create(task_id: str, data: dict) -> None:
+        fields = create_fields(task_id, data)
+        pipe = redis.pipeline(transaction=True)
+        pipe.hset(task_key(task_id), mapping=fields)
+        pipe.expire(task_key(task_id), settings.QUEUE_RESULT_EXPIRES)
+        pipe.zadd(DEADLINES_KEY, {task_id: create_deadline(fields)})
+        pipe.publish(task_channel(task_id), json.dumps(fields))
+        pipe.execute()
+
+    @staticmethod
+    def get(task_id: str) -> Optional[dict]:
+        return to_message(redis.hgetall(task_key(task_id)))
+
+    @staticmethod
+    def transition(task_id: str, updates: Dict[str, Any], guard: Dict[str, List[Optional[str]]] = None,
+                   deadline: str = "") -> bool:
+        """
+        Apply `updates` only when every guarded field currently holds one of the allowed values.
+        Return True when applied.
+        """
+        return _transition(keys=transition_keys(task_id), args=transition_args(task_id, updates, guard, deadline)) == 1
+
+    @staticmethod
+    def started(task_id: str) -> bool:
+        return TaskStateStore.transition(task_id, *Transition.started())
+
+    @staticmethod
+    def success(task_id: str, response: dict) -> bool:
+        return TaskStateStore.transition(task_id, *Transition.success(response))
+
+    @staticmethod
+    def failed(task_id: str, err: dict) -> bool:
+        return TaskStateStore.transition(task_id, *Transition.failed(err))
+
+    @staticmethod
+    def rejected(task_id: str, err: dict) -> bool:
+        return TaskStateStore.transition(task_id, *Transition.rejected(err))
+
+    @staticmethod
+    def killed(task_id: str) -> bool:
+        return TaskStateStore.transition(task_id, *Transition.killed())
+
+
+class AsyncTaskStateStore(object):
+    """`TaskStateStore` on the app's async redis pool, for async routes."""
+    __instance = None
+
+    @staticmethod
+    async def create(task_id: str, data: dict) -> None:
+        fields = create_fields(task_id, data)
+        pipe = redis_async.pipeline(transaction=True)
+        pipe.hset(task_key(task_id), mapping=fields)
+        pipe.expire(task_key(task_id), settings.QUEUE_RESULT_EXPIRES)
+        pipe.zadd(DEADLINES_KEY, {task_id: create_deadline(fields)})
+        pipe.publish(task_channel(task_id), json.dumps(fields))
+        await pipe.execute()
+
+    @staticmethod
+    async def get(task_id: str) -> Optional[dict]:
+        return to_message(await redis_async.hgetall(task_key(task_id)))
+
+    @staticmethod
+    async def transition(task_id: str, updates: Dict[str, Any], guard: Dict[str, List[Optional[str]]] = None,
+                         deadline: str = "") -> bool:
+        return await _transition_async(
+            keys=transition_keys(task_id), args=transition_args(task_id, updates, guard, deadline)) == 1
+
+    @staticmethod
+    async def get_many(task_ids: List[str]) -> List[Optional[dict]]:
+        pipe = redis_async.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(task_key(task_id))
+        return [to_message(raw) for raw in await pipe.execute()]
+
+    @staticmethod
+    async def transition_many(transitions: List[Tuple[str, dict, dict, str]]) -> List[bool]:
+        """[(task_id, updates, guard, deadline), ...] in one round trip."""
+        pipe = redis_async.pipeline(transaction=False)
+        for task_id, updates, guard, deadline in transitions:
+            await _transition_async(
+                keys=transition_keys(task_id), args=transition_args(task_id, updates, guard, deadline), client=pipe)
+        return [applied == 1 for applied in await pipe.execute()]
+
+    @staticmethod
+    async def killed(task_id: str) -> bool:
+        return await AsyncTaskStateStore.transition(task_id, *Transition.killed())
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import List, Optional
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.mq_main import redis_async
+
+CACHE_KEY_PREFIX = "scrape:"
+MIN_WORDS = 50
+TEXT_CONTENT_TYPES = ("text/html", "application/xhtml+xml", "text/plain")
+DROP_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "head")
+
+
+def extract_text(body: bytes, content_type: str) -> str:
+    """Visible text of a page, whitespace collapsed."""
+    if content_type.startswith("text/plain"):
+        text = body.decode("utf-8", errors="ignore")
+    else:
+        import lxml.html
+        from lxml.etree import ParserError
+
+        try:
+            root = lxml.html.document_fromstring(body)
+        except (ParserError, ValueError):
+            return ""
+        # Collected first: dropping while iterating ends the walk early (e.g. once <head> is gone)
+        for element in list(root.iter(*DROP_TAGS)):
+            element.drop_tree()
+        text = root.text_content()
+    return " ".join(text.split())
+
+
+class WebScraper(object):
+    """
+    Text of web pages for the chat web search: fetched concurrently on one pooled async client, each page within
+    SCRAPE_TIMEOUT and SCRAPE_MAX_BYTES, all of them within SCRAPE_DEADLINE.
+    Extracted text is cached per url: served as is for SCRAPE_FRESH, then revalidated (ETag/Last-Modified)
+    until SCRAPE_CACHE_TTL, so a page that didn't change is never parsed twice.
+    """
+    __instance = None
+    _client: Optional[httpx.AsyncClient] = None
+
+    @staticmethod
+    def client() -> httpx.AsyncClient:
+        if WebScraper._client is None:
+            WebScraper._client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=httpx.Timeout(settings.SCRAPE_TIMEOUT),
+                limits=httpx.Limits(max_connections=settings.SCRAPE_CONCURRENCY * 4),
+                headers={"User-Agent": "Mozilla/5.0 (compatible; chatbot-search/1.0)"},
+            )
+        return WebScraper._client
+
+    @staticmethod
+    async def close() -> None:
+        client, WebScraper._client = WebScraper._client, None
+        if client is not None:
+            await client.aclose()
+
+    @staticmethod
+    def cache_key(url: str) -> str:
+        return f"{CACHE_KEY_PREFIX}{hashlib.sha256(url.encode()).hexdigest()}"
+
+    @staticmethod
+    async def cached(url: str) -> Optional[dict]:
+        try:
+            value = await redis_async.get(WebScraper.cache_key(url))
+        except Exception as e:
+            logging.getLogger('app').warning(f"Scrape cache unavailable: {e!r}")
+            return None
+        return json.loads(value) if value else None
+
+    @staticmethod
+    async def remember(url: str, entry: dict) -> None:
+        try:
+            await redis_async.set(WebScraper.cache_key(url), json.dumps(entry, ensure_ascii=False),
+                                  ex=settings.SCRAPE_CACHE_TTL)
+        except Exception as e:
+            logging.getLogger('app').warning(f"Scrape cache unavailable: {e!r}")
+
+    @staticmethod
+    async def read_body(response: httpx.Response) -> bytes:
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            body += chunk
+            if len(body) >= settings.SCRAPE_MAX_BYTES:
+                return bytes(body[:settings.SCRAPE_MAX_BYTES])
+        return bytes(body)
+
+    @staticmethod
+    async def fetch(url: str) -> str:
+        entry = await WebScraper.cached(url)
+        if entry is not None and time.time() - entry["time"] < settings.SCRAPE_FRESH:
+            return entry["text"]
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        async with WebScraper.client().stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and entry is not None:
+                entry["time"] = time.time()
+                await WebScraper.remember(url, entry)
+                return entry["text"]
+            content_type = response.headers.get("content-type", "").lower()
+            if not response.is_success or not content_type.startswith(TEXT_CONTENT_TYPES):
+                return ""
+            body = await WebScraper.read_body(response)
+
+        text = await run_in_threadpool(extract_text, body, content_type)
+        await WebScraper.remember(url, {
+            "time": time.time(),
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "text": text,
+        })
+        return text
+
+    @staticmethod
+    async def scrape(urls: List[str]) -> List[str]:
+        """Texts of the pages fetched in time (in `urls` order), pages with less than MIN_WORDS words skipped."""
+        semaphore = asyncio.Semaphore(settings.SCRAPE_CONCURRENCY)
+
+        async def fetch(url: str) -> str:
+            async with semaphore:
+                try:
+                    # httpx timeouts are per phase (connect, each read...), a slow-drip page needs its own deadline
+                    return await asyncio.wait_for(WebScraper.fetch(url), settings.SCRAPE_TIMEOUT)
+                except (httpx.HTTPError, httpx.InvalidURL, asyncio.TimeoutError) as e:
+                    logging.getLogger('app').info(f"Can't scrape '{url}': {e!r}")
+                    return ""
+
+        tasks = [asyncio.create_task(fetch(url)) for url in urls]
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, timeout=settings.SCRAPE_DEADLINE)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.getLogger('app').info(f"Scrape deadline: {len(pending)}/{len(tasks)} pages dropped")
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        texts = []
+        for task in tasks:
+            if task in done and not task.cancelled() and task.exception() is None:
+                text = task.result()
+                if len(text.split()) >= MIN_WORDS:
+                    texts.append(text)
+        return texts
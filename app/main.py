@@ -1,9 +1,10 @@
+import asyncio
 import logging
 import os
+from functools import partial
 
 import uvicorn
 from fastapi import FastAPI
-from fastapi_sqlalchemy import DBSessionMiddleware
 from starlette.middleware.cors import CORSMiddleware
 
 from fastapi.openapi.docs import (
@@ -14,9 +15,17 @@ from fastapi.openapi.docs import (
 from fastapi.staticfiles import StaticFiles
 from app.api.router import router
 from app.models import Base
-from app.db.base import engine
+from app.db.base import engine, async_engine
+from app.db.session import LazySessionMiddleware
 from app.core.config import settings
+from app.core.security import PasswordHasher
 from app.helpers.exception_handler import CustomException, http_exception_handler
+from app.helpers.llm.clients import LLMClientRegistry
+from app.helpers.llm.retrieval import close_query_embedding_client
+from app.helpers.web_scraper import WebScraper
+from app.helpers.queue.queue_depth import QueueDepthSampler
+from app.helpers.queue.sweeper import TaskDeadlineSweeper
+from app.mq_main import close_redis_async
 
 os.makedirs(os.path.dirname(settings.LOGGING_APP_FILE), exist_ok=True)
 with open(settings.LOGGING_APP_FILE, 'a'):
@@ -45,9 +54,11 @@ def get_application() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
-    application.add_middleware(DBSessionMiddleware, db_url=settings.DATABASE_URL)
+    application.add_middleware(LazySessionMiddleware)
     application.include_router(router, prefix=settings.API_PREFIX)
     application.add_exception_handler(CustomException, http_exception_handler)
+    application.add_event_handler("startup", partial(start_background_tasks, application))
+    application.add_event_handler("shutdown", partial(stop_background_tasks, application))
 
     # static/public -> static
     public_path = "static/public"
@@ -58,6 +69,26 @@ def get_application() -> FastAPI:
     return application
 
 
+def start_background_tasks(application: FastAPI):
+    LLMClientRegistry.startup()
+    application.state.background_tasks = [
+        asyncio.create_task(QueueDepthSampler.run()),
+        asyncio.create_task(TaskDeadlineSweeper.run()),
+    ]
+
+
+async def stop_background_tasks(application: FastAPI):
+    for task in getattr(application.state, "background_tasks", []):
+        task.cancel()
+    await LLMClientRegistry.close()
+    await WebScraper.close()
+    await close_query_embedding_client()
+    PasswordHasher.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+    await close_redis_async()
+
+
 app = get_application()
 
 
@@ -90,4 +121,4 @@ async def redoc_html():
 
 if __name__ == '__main__':
     uvicorn.run(app, host=settings.BASE_HOST,
-                port=settings.BASE_PORT, limit_concurrency=10)
\ No newline at end of file
+                port=settings.BASE_PORT, limit_concurrency=settings.BASE_LIMIT_CONCURRENCY)
\ No newline at end of file
@@ -1,9 +1,35 @@
 from redis import Redis
+from redis import asyncio as aioredis
 from celery import Celery
 from app.core.config import settings
 
 
 redis = Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, password=settings.REDIS_PASS, db=settings.REDIS_DB)
 
+# App (async): bounded pool for commands, separate pool for long-lived pub/sub subscriptions
+redis_async_pool = aioredis.BlockingConnectionPool(
+    host=settings.REDIS_HOST, port=settings.REDIS_PORT, password=settings.REDIS_PASS, db=settings.REDIS_DB,
+    max_connections=settings.REDIS_POOL_SIZE,
+    timeout=settings.REDIS_POOL_TIMEOUT,
+    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    retry_on_timeout=True,
+)
+redis_async = aioredis.Redis(connection_pool=redis_async_pool)
+
+redis_async_pubsub_pool = aioredis.ConnectionPool(
+    host=settings.REDIS_HOST, port=settings.REDIS_PORT, password=settings.REDIS_PASS, db=settings.REDIS_DB,
+    max_connections=settings.REDIS_PUBSUB_POOL_SIZE,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+)
+redis_async_pubsub = aioredis.Redis(connection_pool=redis_async_pubsub_pool)
+
+
+async def close_redis_async():
+    await redis_async_pool.disconnect()
+    await redis_async_pubsub_pool.disconnect()
+
 
 celery_execute = Celery(broker=settings.RABBITMQ_BROKER, backend=settings.REDIS_BACKEND)
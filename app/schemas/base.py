@@ -46,3 +46,11 @@ class MetadataSchema(BaseModel):
     current_page: int
     page_size: int
     total_items: int
+
+
+class CursorMetadataSchema(BaseModel):
+    page_size: int
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+    total_items: Optional[int] = None  # Depends on the requested total mode
+    total_estimated: bool = False
@@ -3,8 +3,8 @@ import os
 from typing import List, Dict, Optional, Union
 from pydantic import BaseModel, root_validator, validator
 
-from app.core.config import settings
 from app.helpers.exception_handler import CustomException
+from app.helpers.llm.lc_store import lc_file_path
 from app.schemas.chatbot import BaseChatRequest
 
 
@@ -12,6 +12,8 @@ from app.schemas.chatbot import BaseChatRequest
 class EmbedDocRequest(BaseModel):
     chat_type: str
     urls: Optional[List[str]] = []
+    data_id: Optional[str] = None
+    remove_sources: Optional[List[str]] = []
 
     class Config:
         schema_extra = {
@@ -21,6 +23,8 @@ class EmbedDocRequest(BaseModel):
                     "https://aiservices-bucket.s3.amazonaws.com/chat-vision/screen.jpg",
                     "https://python.langchain.com/v0.2/docs/how_to/#document-loaders"
                 ],
+                "data_id": None,
+                "remove_sources": [],
             }
         }
 
@@ -30,6 +34,12 @@ class EmbedDocRequest(BaseModel):
         types = ['lc', 'rag']
         if chat_type.strip() not in types:
             raise CustomException(http_code=400, code='400', message=f"Invalid chat type '{chat_type}'.")
+
+        data_id = values.get('data_id') or ""
+        if data_id.strip() and chat_type.strip() != 'rag':
+            raise CustomException(http_code=400, code='400', message="[data_id] is only supported with chat type 'rag'.")
+        if values.get('remove_sources') and not data_id.strip():
+            raise CustomException(http_code=400, code='400', message="[remove_sources] needs a [data_id].")
         return values
 
     @classmethod
@@ -72,7 +82,7 @@ class ChatDocLCRequest(BaseChatRequest):
         if not data_id.strip():
             raise CustomException(http_code=400, code='400', message=f"[data_id] is not empty.")
 
-        if not os.path.exists(os.path.join(settings.WORKER_DIRECTORY, "chatdoc/lc", f"{data_id}.md")):
+        if not os.path.exists(lc_file_path(data_id)):
             raise ValueError(f"[data_id] does not exist. Must 'embed before'")
 
         return values
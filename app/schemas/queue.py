@@ -1,4 +1,4 @@
-from typing import Optional, Any
+from typing import Optional, Any, List
 from pydantic import BaseModel, validator, root_validator
 from datetime import datetime
 
@@ -26,3 +26,20 @@ class QueueResponse(BaseModel):
     status: str = "PENDING"
     time: datetime
     task_id: str
+
+
+class QueueStatusBatchRequest(BaseModel):
+    task_ids: List[str]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "task_ids": ["<task_id_1>", "<task_id_2>"],
+            }
+        }
+
+    @validator('task_ids')
+    def check_task_ids(cls, value):
+        if not value or len(value) > 100:
+            raise ValueError("task_ids must have between 1 and 100 items.")
+        return value
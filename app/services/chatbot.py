@@ -1,9 +1,16 @@
+import asyncio
 import json
 import logging
 from datetime import datetime
 from typing import Optional, Tuple, Text, Dict, List, Union
 
+from openai import APIError
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
 from app.helpers.exception_handler import CustomException
+from app.helpers.llm.search_intent import SearchIntentClassifier, NO_SEARCH
+from app.helpers.llm.speculative import SpeculativeStream
 from app.schemas.chatbot import ChatRequest, ChatVisionRequest
 from app.services.common import ChatOpenAIServices
 
@@ -45,28 +52,68 @@ class ChatService(object):
             raise CustomException(http_code=500, code='500', message="Internal Server Error")
 
 
-def chat_openai(request: Union[ChatRequest, ChatVisionRequest]):
+async def chat_openai(request: Union[ChatRequest, ChatVisionRequest]):
     message_id = f"message_id_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
 
     # Init Chat
     chat = ChatOpenAIServices(request)
     chat.init_system_prompt(getattr(request, 'store_name', None))
 
-    # Searching
-    yield from search_mode(message_id, chat.messages)
-
-    # Chatting
-    yield from chat.stream(stream_type="CHATTING", message_id=message_id)
-    chat_metadata = [chat.metadata('chat')]
-    yield chat.stream_data(stream_type="METADATA", message_id=message_id, data=json.dumps(chat_metadata))
+    # Search mode: decided locally or from the cache when possible. Otherwise the LLM check runs while the answer
+    # is already generated without search, kept when the check says no search and cancelled when it says search.
+    likely_search = SearchIntentClassifier.fast_path(chat.messages)
+    response = NO_SEARCH if likely_search is False else await SearchIntentClassifier.cached(chat.messages)
+    search, speculative = None, None
+    try:
+        if response is None:
+            search = search_checker(chat.messages)
+            if likely_search is None:
+                chat = chat.fork()
+                speculative = SpeculativeStream(chat.stream(stream_type="CHATTING", message_id=message_id))
+            response = await check_search_mode(search, chat.messages)
+            if response['web_browser_mode'] and speculative is not None:
+                await speculative.cancel()
+                chat, speculative = chat.fork(), None
+
+        # Searching
+        async for event in search_mode(message_id, chat.messages, response, search):
+            yield event
+
+        # Chatting
+        async for event in speculative or chat.stream(stream_type="CHATTING", message_id=message_id):
+            yield event
+        chat_metadata = [await chat.metadata('chat')]
+        yield chat.stream_data(stream_type="METADATA", message_id=message_id, data=json.dumps(chat_metadata))
+
+        # Done
+        yield chat.stream_data(stream_type="DONE", message_id=message_id, data="DONE")
+    finally:
+        if speculative is not None:
+            await speculative.cancel()
+
+
+def search_checker(messages: list) -> ChatOpenAIServices:
+    from app.schemas.chatbot import BaseChatRequest
+    from app.helpers.llm.preprompts.store import check_web_browser_prompt
 
-    # Done
-    yield chat.stream_data(stream_type="DONE", message_id=message_id, data="DONE")
+    search_model = {
+        "platform": "OpenAI",
+        "model_name": "gpt-4o-mini",
+        "temperature": 0.5,
+        "max_tokens": 4096,
+    }
+    search_request = BaseChatRequest(messages=messages[1:], chat_model=search_model)
+    search = ChatOpenAIServices(search_request)
+    search.messages = [
+        {"role": "system", "content": check_web_browser_prompt()},
+        {"role": "user", "content": f"""Check mode with user query input is: \n{search.messages_to_str()}\n"""}
+    ]
+    return search
 
 
-def search_mode(message_id: str, messages: list):
+async def check_search_mode(search: ChatOpenAIServices, messages: list) -> dict:
     """
-     Search data from user input
+     Check search mode from user input with the LLM; no search when the check fails or is too slow
 
      response:
         {
@@ -80,47 +127,45 @@ def search_mode(message_id: str, messages: list):
         }
 
     """
-    from app.schemas.chatbot import BaseChatRequest
-    from app.helpers.llm.preprompts.store import check_web_browser_prompt, user_prompt_checked_web_browser
-    from app.services.common import GoogleSearchService
-
     logging.getLogger('app').info("-- CHECK MODE WEB SEARCH:")
+    try:
+        response = await asyncio.wait_for(search.function_calling(), timeout=settings.SEARCH_INTENT_CHECK_TIMEOUT)
+    except (asyncio.TimeoutError, APIError, ValueError, KeyError) as e:
+        logging.getLogger('app').warning(f"Web search check failed, chat without search: {e!r}")
+        return NO_SEARCH
+    await SearchIntentClassifier.remember(messages, response)
+    return response
 
-    # Check search mode
-    search_model = {
-        "platform": "OpenAI",
-        "model_name": "gpt-4o-mini",
-        "temperature": 0.5,
-        "max_tokens": 4096,
-    }
-    search_request = BaseChatRequest(messages=messages[1:], chat_model=search_model)
-    search = ChatOpenAIServices(search_request)
-    search.messages = [
-        {"role": "system", "content": check_web_browser_prompt()},
-        {"role": "user", "content": f"""Check mode with user query input is: \n{search.messages_to_str()}\n"""}
-    ]
-    response = search.function_calling()
+
+async def search_mode(message_id: str, messages: list, response: dict, search: Optional[ChatOpenAIServices] = None):
+    """
+     Search data from user input when `response` enables web browser mode, `search` is the LLM check (if any)
+    """
+    from app.helpers.llm.preprompts.store import user_prompt_checked_web_browser
+    from app.services.common import GoogleSearchService
+
+    check_metadata = [await search.metadata('check_web_search')] if search is not None else []
 
     # Stream search mode
     if response['web_browser_mode']:
-        yield search.stream_data(stream_type="SEARCHING", message_id=message_id, data="Searching...")
+        yield ChatOpenAIServices.stream_data(stream_type="SEARCHING", message_id=message_id, data="Searching...")
         question = f"{response['request']['query']} {response['request']['time']}"
-        urls, gg_metadata = GoogleSearchService().google_search(
+        urls, gg_metadata = await run_in_threadpool(
+            GoogleSearchService.google_search,
             question,
             num=response['request']['num_link'],
             lr=f"lang_{response['request']['language']}",
         )
-        yield search.stream_data(stream_type="SEARCHED", message_id=message_id, data=json.dumps(urls))
-        metadata = [gg_metadata, search.metadata('check_web_search')]
-        yield search.stream_data(stream_type="METADATA", message_id=message_id, data=json.dumps(metadata))
+        yield ChatOpenAIServices.stream_data(stream_type="SEARCHED", message_id=message_id, data=json.dumps(urls))
+        metadata = [gg_metadata] + check_metadata
+        yield ChatOpenAIServices.stream_data(stream_type="METADATA", message_id=message_id, data=json.dumps(metadata))
 
-        texts_searched = GoogleSearchService().web_scraping(urls)
+        texts_searched = await GoogleSearchService.web_scraping(urls)
         logging.getLogger('app').info("-- DATA SEARCHED: ")
         logging.getLogger('app').info(texts_searched)
 
         # Update message when have data browser
         messages[-1]['content'] = user_prompt_checked_web_browser(messages[-1]['content'], urls, texts_searched)
 
-    else:
-        metadata = [search.metadata('check_web_search')]
-        yield search.stream_data(stream_type="METADATA", message_id=message_id, data=json.dumps(metadata))
+    elif check_metadata:
+        yield ChatOpenAIServices.stream_data(stream_type="METADATA", message_id=message_id, data=json.dumps(check_metadata))
@@ -1,18 +1,21 @@
 import json
 import inspect
 import logging
-import os
 from datetime import datetime
 
 from app.core.config import settings
 from app.helpers.exception_handler import CustomException
+from app.helpers.llm.lc_store import LCDocumentStore
 from app.helpers.llm.preprompts.store import user_prompt_add_document_lc
-from app.mq_main import celery_execute, redis
+from app.helpers.llm.retrieval import DocumentRetriever
+from app.helpers.queue.task_state import TaskStateStore
+from app.mq_main import celery_execute
 from app.schemas.base import DataResponse
 from app.schemas.chatdoc import ChatDocLCRequest, ChatDocRAGRequest
 from app.schemas.queue import QueueResult
 
 from sse_starlette import EventSourceResponse
+from starlette.concurrency import run_in_threadpool
 
 from app.services.common import ChatOpenAIServices
 
@@ -36,19 +39,16 @@ class ChatDocService(object):
                     'data': data_dump,
                     'request': request,
                 },
-                queue=settings.WORKER_NAME
+                queue=settings.WORKER_NAME,
+                task_id=task_id,
             )
         except ValueError as e:
             logging.getLogger('app').debug(e, exc_info=True)
-            data.status['general_status'] = "FAILED"
-            data.error = {'code': "400", 'message': str(e)}
-            redis.set(task_id, json.dumps(data.__dict__))
+            TaskStateStore.rejected(task_id, {'code': "400", 'message': str(e)})
 
         except Exception as e:
             logging.getLogger('app').debug(e, exc_info=True)
-            data.status['general_status'] = "FAILED"
-            data.error = {'code': "500", 'message': "Internal Server Error"}
-            redis.set(task_id, json.dumps(data.__dict__))
+            TaskStateStore.rejected(task_id, {'code': "500", 'message': "Internal Server Error"})
 
 
     @staticmethod
@@ -119,28 +119,34 @@ class ChatDocService(object):
 
 
 
-def chatdoclc_openai(request: ChatDocLCRequest):
+async def chatdoclc_openai(request: ChatDocLCRequest):
     message_id = f"message_id_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
 
     # Init Chat
     chatdoc = ChatOpenAIServices(request)
     chatdoc.init_system_prompt(chat_document_mode=True)
 
-    # Add document into LLM
-    with open(os.path.join(settings.WORKER_DIRECTORY, "chatdoc/lc", f"{request.data_id}.md"), 'r', encoding='utf-8') as file:
-        document = file.read()
-    chatdoc.messages[-1]['content'] = user_prompt_add_document_lc(chatdoc.messages[-1]['content'], document)
+    # Add document into LLM, trimmed to what fits beside the conversation and the answer
+    document = await run_in_threadpool(LCDocumentStore.get, request.data_id)
+    budget = (settings.LC_CONTEXT_WINDOW - chatdoc.max_tokens - settings.LC_PROMPT_RESERVE
+              - await run_in_threadpool(chatdoc.num_tokens_from_string_openai, chatdoc.messages_to_str()))
+    document_text = await run_in_threadpool(document.text, max_tokens=max(budget, 0))
+    if budget < document.num_tokens:
+        logging.getLogger('app').info(f"Document '{request.data_id}' trimmed to {budget}/{document.num_tokens} tokens")
+    chatdoc.messages[-1]['content'] = user_prompt_add_document_lc(chatdoc.messages[-1]['content'], document_text)
 
     # Chatting
-    yield from chatdoc.stream(stream_type="CHATTING", message_id=message_id)
-    chat_metadata = [chatdoc.metadata('chatdoc')]
+    async for event in chatdoc.stream(stream_type="CHATTING", message_id=message_id):
+        yield event
+    chat_metadata = [await chatdoc.metadata('chatdoc')]
+    chat_metadata[0]["document"] = {"tokens": document.num_tokens, "truncated": budget < document.num_tokens}
     yield chatdoc.stream_data(stream_type="METADATA", message_id=message_id, data=json.dumps(chat_metadata))
 
     # Done
     yield chatdoc.stream_data(stream_type="DONE", message_id=message_id, data="DONE")
 
 
-def chatdocrag_openai(request: ChatDocRAGRequest):
+async def chatdocrag_openai(request: ChatDocRAGRequest):
     message_id = f"message_id_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
 
     # Init Chat
@@ -148,17 +154,14 @@ def chatdocrag_openai(request: ChatDocRAGRequest):
     chatdoc.init_system_prompt(chat_document_mode=True)
 
     # Retrieval
-    document = retrieval_document(request.data_id, request.messages)
+    document = await DocumentRetriever().aretrieve(request.data_id, request.messages)
     chatdoc.messages[-1]['content'] = user_prompt_add_document_lc(chatdoc.messages[-1]['content'], document)
 
     # Chatting
-    yield from chatdoc.stream(stream_type="CHATTING", message_id=message_id)
-    chat_metadata = [chatdoc.metadata('chatdoc')]
+    async for event in chatdoc.stream(stream_type="CHATTING", message_id=message_id):
+        yield event
+    chat_metadata = [await chatdoc.metadata('chatdoc')]
     yield chatdoc.stream_data(stream_type="METADATA", message_id=message_id, data=json.dumps(chat_metadata))
 
     # Done
     yield chatdoc.stream_data(stream_type="DONE", message_id=message_id, data="DONE")
-
-
-def retrieval_document(data_id: str, messages: list) -> str:
-    return ""
@@ -1,10 +1,10 @@
+import copy
 import json
 import logging
 import os
 import mimetypes
 import re
 import uuid
-import httpx
 import requests
 from datetime import datetime
 from urllib.parse import urlparse
@@ -14,12 +14,13 @@ from fastapi import UploadFile
 from requests.exceptions import HTTPError
 
 from app.core.config import settings
+from app.helpers.llm.clients import LLMClientRegistry
+from app.helpers.llm.tokens import TokenUsage, count_tokens
+from app.helpers.web_scraper import WebScraper
 from app.schemas.queue import QueueTimeHandle, QueueStatusHandle, QueueResult
 from app.schemas.chatbot import BaseChatRequest
 
 from googleapiclient.discovery import build
-from bs4 import BeautifulSoup
-from openai import OpenAI
 
 
 class CommonService(object):
@@ -122,24 +123,15 @@ class GoogleSearchService(object):
         return urls, metadata
 
     @staticmethod
-    def web_scraping(urls) -> List:
-        texts = []
-        for url in urls:
-            try:
-                response = requests.get(url)
-            except:
-                continue
-            if response.ok:
-                soup = BeautifulSoup(response.content, features="html.parser")
-                text = soup.text.replace("\n", " ")
-                text = " ".join(text.split())
-                if len(text.split()) < 50:
-                    continue
-                texts.append(text)
-
-        return texts
+    async def web_scraping(urls) -> List:
+        return await WebScraper.scrape(urls)
 
 class ChatOpenAIServices:
+    """
+    Chat completions on the shared `AsyncOpenAI` client of the platform: `stream` is an async generator, so an SSE
+    stream waiting on the LLM holds no thread.
+    """
+
     def __init__(self, request: BaseChatRequest):
         self.messages = request.messages
         self.host = request.chat_model.platform
@@ -147,18 +139,10 @@ class ChatOpenAIServices:
         self.temperature = request.chat_model.temperature
         self.max_tokens = request.chat_model.max_tokens
 
-        if self.host == "OpenAI":
-            self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        elif self.host == 'local':
-            self.client = OpenAI(
-                base_url=settings.LLM_URL,
-                default_headers={"x-foo": "true"},
-                http_client=httpx.Client(verify=False)
-            )
-        else:
-            raise ValueError(f"""Don't existed {self.host} platform""")
+        self.client = LLMClientRegistry.get(self.host)
 
         self.answer = ""
+        self.usage = TokenUsage()
 
     def init_system_prompt(self, store_name: str = None, chat_document_mode: bool = False):
         from app.helpers.llm.preprompts.store import get_system_prompt
@@ -170,6 +154,14 @@ class ChatOpenAIServices:
         else:
             self.messages[0]['content'] = get_system_prompt(input_pmt=self.messages[0]['content'], chat_document_mode=chat_document_mode)
 
+    def fork(self) -> "ChatOpenAIServices":
+        """Same chat on its own copy of the messages (for a speculative completion)."""
+        other = copy.copy(self)
+        other.messages = copy.deepcopy(self.messages)
+        other.answer = ""
+        other.usage = TokenUsage()
+        return other
+
     def messages_to_str(self) -> str:
         mess_str = ""
         for mess in self.messages:
@@ -185,27 +177,42 @@ class ChatOpenAIServices:
             "data": data,
         }
 
-    def stream(self, stream_type: str, message_id: str):
+    async def stream(self, stream_type: str, message_id: str):
         # Log message
         logging.getLogger('app').info(f"-- TYPE: {stream_type}. PROMPT: ")
         logging.getLogger('app').info(self.messages_to_str())
 
-        stream = self.client.chat.completions.create(
+        stream = await self.client.chat.completions.create(
             messages=self.messages,
             model=self.model,
             temperature=self.temperature,
             max_tokens=self.max_tokens,
             stream=True,
+            **self.stream_usage_options(),
         )
 
-        for line in stream:
-            if line.choices[0].delta.content:
-                current_response = line.choices[0].delta.content
-                self.answer += current_response
-                yield self.stream_data(stream_type, message_id, current_response.replace("\n", "<!<newline>!>"))
+        try:
+            async for line in stream:
+                # Last chunk (include_usage): no choices, usage only
+                self.usage.set_provider_usage(getattr(line, "usage", None))
+                if line.choices and line.choices[0].delta.content:
+                    current_response = line.choices[0].delta.content
+                    self.answer += current_response
+                    self.usage.add_delta(current_response)
+                    yield self.stream_data(stream_type, message_id, current_response.replace("\n", "<!<newline>!>"))
+        finally:
+            # Cancelled/closed early: give the connection back instead of reading the rest of the answer
+            await stream.response.aclose()
+
+    def stream_usage_options(self) -> dict:
+        """Ask OpenAI for `usage` in the last stream chunk (through `extra_body`: not a typed arg of this SDK)."""
+        if self.host == "OpenAI":
+            return {"extra_body": {"stream_options": {"include_usage": True}}}
+        return {}
 
 
-    def metadata(self, task_name: str):
+    async def metadata(self, task_name: str):
+        messages_str = self.messages_to_str()
         return {
             "task": task_name,
             "chat_model":{
@@ -215,35 +222,30 @@ class ChatOpenAIServices:
                     "max_tokens": self.max_tokens,
             },
             "response": {
-                "input": self.messages_to_str(),
+                "input": messages_str,
                 "output": self.answer,
             },
-            "usage": {
-                "input": self.num_tokens_from_string_openai(self.messages_to_str()),
-                "output": self.num_tokens_from_string_openai(self.answer),
-            }
+            "usage": await self.usage.ato_dict(messages_str),
         }
 
     @staticmethod
     def num_tokens_from_string_openai(string: str) -> int:
-        import tiktoken
-        encoding_name = "o200k_base"
-        encoding = tiktoken.get_encoding(encoding_name)
-        num_tokens = len(encoding.encode(string))
-        return num_tokens
+        return count_tokens(string)
 
-    def function_calling(self) -> dict:
+    async def function_calling(self) -> dict:
         # Log message
         logging.getLogger('app').info(f"PROMPT: ")
         logging.getLogger('app').info(self.messages_to_str())
 
-        response = self.client.chat.completions.create(
+        response = await self.client.chat.completions.create(
             model=self.model,
             temperature=self.temperature,
             response_format={"type": "json_object"},
             messages=self.messages
         )
         self.answer = response.choices[0].message.content
+        if not self.usage.set_provider_usage(getattr(response, "usage", None)):
+            self.usage.add_delta(self.answer)
         output = json.loads(self.answer, strict=False)
 
         return output
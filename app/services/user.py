@@ -3,13 +3,17 @@ import jwt
 from typing import Optional
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer
-from fastapi_sqlalchemy import db
+from app.db.session import db
 from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from app.models import User
 from app.core.config import settings
-from app.core.security import verify_password, get_password_hash
+from app.core.security import PasswordHasher
+from app.db.base import AsyncSessionLocal
+from app.helpers.principal_cache import PrincipalCache, token_fingerprint
 from app.schemas.token import TokenPayload
 from app.schemas.user import UserCreateRequest, UserUpdateMeRequest, UserUpdateRequest, UserRegisterRequest, \
     UserItemResponse
@@ -31,37 +35,60 @@ class UserService(object):
         user = db.session.query(User).filter_by(username=username).first()
         if not user:
             return None
-        if not verify_password(password, user.hashed_password):
+        valid, new_hash = PasswordHasher.verify_and_update(password, user.hashed_password)
+        if not valid:
             return None
+        if new_hash:
+            # Hashing scheme/cost changed: saved with the caller's commit
+            user.hashed_password = new_hash
         return user
 
     @staticmethod
-    def get_current_user(http_authorization_credentials=Depends(reusable_oauth2)) -> User:
-        """
-        Decode JWT token to get user_id => return User info from DB query
-        """
+    def decode_token(token: str) -> TokenPayload:
         try:
-            payload = jwt.decode(
-                http_authorization_credentials.credentials, settings.SECRET_KEY,
-                algorithms=[settings.SECURITY_ALGORITHM]
-            )
-            token_data = TokenPayload(**payload)
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.SECURITY_ALGORITHM])
+            return TokenPayload(**payload)
         except(jwt.PyJWTError, ValidationError):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Could not validate credentials",
             )
+
+    @staticmethod
+    def get_current_user(http_authorization_credentials=Depends(reusable_oauth2)) -> User:
+        """
+        Decode JWT token to get user_id => return User info from DB query
+        """
+        token_data = UserService.decode_token(http_authorization_credentials.credentials)
         user = db.session.query(User).get(token_data.user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         return user
 
+    @staticmethod
+    def get_current_principal(http_authorization_credentials=Depends(reusable_oauth2)) -> UserItemResponse:
+        """
+        Decode JWT token to get user_id => return User info from the principal cache, DB query on miss
+        """
+        token = http_authorization_credentials.credentials
+        token_data = UserService.decode_token(token)
+        fingerprint = token_fingerprint(token)
+        principal = PrincipalCache.get(token_data.user_id, fingerprint)
+        if principal is None:
+            generation = PrincipalCache.generation(token_data.user_id)
+            user = db.session.query(User).get(token_data.user_id)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            principal = UserItemResponse.from_orm(user)
+            PrincipalCache.put(token_data.user_id, fingerprint, principal, generation)
+        return principal
+
     @staticmethod
     def register_user(data: UserRegisterRequest):
         register_user = User(
             username=data.username,
             email=data.email,
-            hashed_password=get_password_hash(data.password),
+            hashed_password=PasswordHasher.hash(data.password),
             is_active=True,
             role=data.role.value,
         )
@@ -73,7 +100,7 @@ class UserService(object):
     def create_user(data: UserCreateRequest) -> UserItemResponse:
         new_user = User(
             username=data.username,
-            hashed_password=get_password_hash(data.password),
+            hashed_password=PasswordHasher.hash(data.password),
             is_active=data.is_active,
             role=data.role.value,
         )
@@ -90,17 +117,65 @@ class UserService(object):
     @staticmethod
     def update_me(data: UserUpdateMeRequest, current_user: User):
         current_user.username = current_user.username if data.username is None else data.username
-        current_user.hashed_password = current_user.hashed_password if data.password is None else get_password_hash(
+        current_user.hashed_password = current_user.hashed_password if data.password is None else PasswordHasher.hash(
             data.password)
         db.session.commit()
+        PrincipalCache.invalidate(current_user.id)
         return current_user
 
     @staticmethod
     def update(user: User, data: UserUpdateRequest):
         user.username = user.username if data.username is None else data.username
-        user.hashed_password = user.hashed_password if data.password is None else get_password_hash(
+        user.hashed_password = user.hashed_password if data.password is None else PasswordHasher.hash(
             data.password)
         user.is_active = user.is_active if data.is_active is None else data.is_active
         user.role = user.role if data.role is None else data.role.value
         db.session.commit()
+        PrincipalCache.invalidate(user.id)
+        return user
+
+
+class AsyncUserService(object):
+    """
+    `UserService` on the async engine (DB_ASYNC), served on the event loop
+    (password hashing/verification awaited on the `PasswordHasher` pool).
+    """
+    __instance = None
+
+    @staticmethod
+    async def authenticate(session: AsyncSession, *, username: str, password: str) -> Optional[User]:
+        """
+        Check username and password is correct.
+        Return object User if correct, else return None
+        """
+        user = (await session.execute(select(User).filter_by(username=username))).scalars().first()
+        if not user:
+            return None
+        valid, new_hash = await PasswordHasher.averify_and_update(password, user.hashed_password)
+        if not valid:
+            return None
+        if new_hash:
+            # Hashing scheme/cost changed: saved with the caller's commit
+            user.hashed_password = new_hash
         return user
+
+    @staticmethod
+    async def get_current_principal(
+            http_authorization_credentials=Depends(UserService.reusable_oauth2)) -> UserItemResponse:
+        """
+        Decode JWT token to get user_id => return User info from the principal cache, DB query on miss
+        """
+        token = http_authorization_credentials.credentials
+        token_data = UserService.decode_token(token)
+        fingerprint = token_fingerprint(token)
+        principal = await PrincipalCache.aget(token_data.user_id, fingerprint)
+        if principal is None:
+            generation = await PrincipalCache.ageneration(token_data.user_id)
+            # Own short session: nothing held while the request goes on
+            async with AsyncSessionLocal() as session:
+                user = await session.get(User, token_data.user_id)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            principal = UserItemResponse.from_orm(user)
+            await PrincipalCache.aput(token_data.user_id, fingerprint, principal, generation)
+        return principal
@@ -12,7 +12,7 @@ from typing import Any, Generator
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 from app.db.base import get_db
-from fastapi_sqlalchemy import DBSessionMiddleware
+from app.db.session import LazySessionMiddleware
 from dotenv import load_dotenv
 
 load_dotenv(verbose=True)
@@ -216,7 +216,7 @@ def app() -> Generator[FastAPI, Any, None]:
     """
     Base.metadata.create_all(engine)  # Create the tables.
     _app = get_application()
-    _app.add_middleware(DBSessionMiddleware, db_url=SQLALCHEMY_DATABASE_URL)
+    _app.add_middleware(LazySessionMiddleware, db_url=SQLALCHEMY_DATABASE_URL)
     yield _app
     Base.metadata.drop_all(engine)
 
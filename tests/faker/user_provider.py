@@ -3,7 +3,7 @@ import faker.providers
 
 from app.helpers.enums import UserRole
 from app.models import User
-from fastapi_sqlalchemy import db
+from app.db.session import db
 from app.core.security import get_password_hash
 
 logger = logging.getLogger()
@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.helpers.llm.embedding_client import EmbeddingClient
+
+
+class EmbeddingServer:
+    """TEI `POST /embed` stub: the vector of "text-<i>" is [i], batches over `max_batch_size` get a 413."""
+
+    def __init__(self, max_batch_size: int, throttled: int = 0):
+        self.max_batch_size = max_batch_size
+        self.throttled = throttled
+        self.batches = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        inputs = json.loads(request.content)["inputs"]
+        if self.throttled:
+            self.throttled -= 1
+            return httpx.Response(429, headers={"retry-after": "0"})
+        if len(inputs) > self.max_batch_size:
+            return httpx.Response(413)
+        self.batches.append(len(inputs))
+        return httpx.Response(200, json=[[float(text.split("-")[1])] for text in inputs])
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(settings, "EM_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(settings, "EM_BACKOFF_MAX", 0.01)
+
+
+def embed(server: EmbeddingServer, texts: list, **kwargs) -> tuple:
+    client = EmbeddingClient(base_url="http://em", transport=httpx.MockTransport(server), **kwargs)
+
+    async def run():
+        try:
+            return await client.embed(texts)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run()), client
+
+
+class TestEmbeddingClient:
+    def test_split_on_413(self, fast_backoff):
+        """
+            Batches over the server limit are split, and the limit is never exceeded again
+            Step by step:
+            - Server accepts at most 5 texts per request
+            - Embed 100 texts starting at a batch size of 16
+            - Expected:
+                . every text gets its own vector, in order
+                . max_batch_size <= 5, no accepted batch over 5
+        """
+        server = EmbeddingServer(max_batch_size=5)
+        texts = [f"text-{i}" for i in range(100)]
+        vectors, client = embed(server, texts, batch_size=16, max_batch_size=64, concurrency=4)
+
+        assert vectors == [[float(i)] for i in range(100)]
+        assert client.max_batch_size <= 5
+        assert max(server.batches) <= 5
+        assert sum(server.batches) == 100
+
+    def test_backoff_on_429(self, fast_backoff, monkeypatch):
+        """
+            Throttled requests are retried, and each 429 halves the batch size
+            Step by step:
+            - Server answers 429 to the first 3 requests, batch size growth disabled
+            - Embed 40 texts, one request in flight
+            - Expected:
+                . every text gets its own vector, in order
+                . 3 retries, the throttled span is resent whole, the next ones have 8 / 2**3 texts
+        """
+        monkeypatch.setattr(settings, "EM_BATCH_STEP", 0)
+        server = EmbeddingServer(max_batch_size=64, throttled=3)
+        texts = [f"text-{i}" for i in range(40)]
+        vectors, client = embed(server, texts, batch_size=8, max_batch_size=8, concurrency=1)
+
+        assert vectors == [[float(i)] for i in range(40)]
+        assert client.stats()["retries"] == 3
+        assert server.batches == [8] + [1] * 32
+
+    def test_retries_exhausted(self, fast_backoff):
+        """
+            A server that keeps throttling fails the call once retries are exhausted
+            Step by step:
+            - Server answers 429 to every request
+            - Expected:
+                . httpx.HTTPStatusError
+        """
+        server = EmbeddingServer(max_batch_size=64, throttled=10 ** 6)
+        with pytest.raises(httpx.HTTPStatusError):
+            embed(server, ["text-0"], retries=2, concurrency=1)
+
+    def test_failure_cancels_workers(self):
+        """
+            The first failed request stops the other workers instead of leaving them running
+            Step by step:
+            - Server rejects the first request (400), holds the others until cancelled
+            - Embed 40 texts, 4 requests in flight
+            - Expected:
+                . httpx.HTTPStatusError, without waiting for the held requests
+                . the held requests are cancelled, no request sent after the failure
+        """
+        held = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if not held:
+                held.append(None)
+                return httpx.Response(400)
+            held.append(asyncio.current_task())
+            await asyncio.sleep(60)
+            return httpx.Response(200, json=[[0.0]] * len(json.loads(request.content)["inputs"]))
+
+        client = EmbeddingClient(base_url="http://em", transport=httpx.MockTransport(handler),
+                                 batch_size=4, concurrency=4, retries=0)
+
+        async def run():
+            try:
+                with pytest.raises(httpx.HTTPStatusError):
+                    await asyncio.wait_for(client.embed([f"text-{i}" for i in range(40)]), 5)
+            finally:
+                await client.aclose()
+
+        asyncio.run(run())
+        assert len(held) == 4
+        assert all(task.cancelled() for task in held[1:])
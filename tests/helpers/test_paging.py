@@ -0,0 +1,120 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.helpers.exception_handler import CustomException
+from app.helpers.paging import CursorParams, cursor_paginate
+from app.models import User
+from app.models.base import Base
+
+SORTABLE = ('id', 'created_at')
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    # 25 users, created_at ties by groups of 3 so (created_at, id) has to break them
+    start = datetime(2024, 1, 1)
+    session.add_all([User(username=f"user{i}", hashed_password="x", created_at=start + timedelta(hours=i // 3))
+                     for i in range(25)])
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def walk(session, direction: str, **params) -> list:
+    """Ids of every page, following next_cursor (or prev_cursor from the last page)."""
+    pages, cursor = [], params.pop("cursor", None)
+    while True:
+        page = cursor_paginate(User, session.query(User), CursorParams(cursor=cursor, **params), SORTABLE)
+        pages.append([user.id for user in page.data])
+        cursor = page.metadata.next_cursor if direction == "next" else page.metadata.prev_cursor
+        if cursor is None:
+            return pages
+
+
+def expected_ids(session, sort_by: str, order: str) -> list:
+    users = session.query(User).all()
+    return [user.id for user in sorted(users, key=lambda user: (getattr(user, sort_by), user.id),
+                                       reverse=order == 'desc')]
+
+
+class TestCursorPaginate:
+    @pytest.mark.parametrize("sort_by", SORTABLE)
+    @pytest.mark.parametrize("order", ['asc', 'desc'])
+    def test_walk_forward(self, session, sort_by, order):
+        """
+            next_cursor walks every row once, in order
+            Step by step:
+            - 25 users, pages of 10, sorted by id or created_at (with ties)
+            - Expected:
+                . pages of 10, 10, 5 covering the expected order, no next_cursor on the last page
+        """
+        pages = walk(session, "next", page_size=10, sort_by=sort_by, order=order)
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert sum(pages, []) == expected_ids(session, sort_by, order)
+
+    @pytest.mark.parametrize("sort_by", SORTABLE)
+    @pytest.mark.parametrize("order", ['asc', 'desc'])
+    def test_walk_backward(self, session, sort_by, order):
+        """
+            prev_cursor from the last page walks back to the first page, pages still in sort order
+            Step by step:
+            - Walk forward to the last page, then follow prev_cursor
+            - Expected:
+                . the same pages as forward, in reverse, no prev_cursor on the first page
+        """
+        forward = walk(session, "next", page_size=10, sort_by=sort_by, order=order)
+        last = cursor_paginate(User, session.query(User), CursorParams(page_size=10, sort_by=sort_by, order=order),
+                               SORTABLE)
+        while last.metadata.next_cursor:
+            last = cursor_paginate(User, session.query(User), CursorParams(
+                cursor=last.metadata.next_cursor, page_size=10, sort_by=sort_by, order=order), SORTABLE)
+
+        backward = walk(session, "prev", cursor=last.metadata.prev_cursor, page_size=10, sort_by=sort_by, order=order)
+        assert backward == forward[-2::-1]
+
+    def test_total(self, session):
+        """
+            Total only counted when asked
+            Step by step:
+            - First page with total 'none', then 'exact'
+            - Expected:
+                . None, then 25
+        """
+        page = cursor_paginate(User, session.query(User), CursorParams(page_size=10), SORTABLE)
+        assert page.metadata.total_items is None
+        page = cursor_paginate(User, session.query(User), CursorParams(page_size=10, total='exact'), SORTABLE)
+        assert page.metadata.total_items == 25
+
+    @pytest.mark.parametrize("sort_by", ['hashed_password', 'metadata', 'missing'])
+    def test_unsortable(self, session, sort_by):
+        """
+            Only whitelisted columns can be sorted on
+            Step by step:
+            - Sort by a private column, a non column attribute, a missing one
+            - Expected:
+                . 400
+        """
+        with pytest.raises(CustomException) as e:
+            cursor_paginate(User, session.query(User), CursorParams(sort_by=sort_by), SORTABLE)
+        assert e.value.http_code == 400
+
+    def test_invalid_cursor(self, session):
+        """
+            Tampered cursors and cursors of another listing are rejected
+            Step by step:
+            - Cursor that isn't base64 JSON, cursor of an id listing used on a created_at listing
+            - Expected:
+                . 400
+        """
+        page = cursor_paginate(User, session.query(User), CursorParams(page_size=10), SORTABLE)
+        for cursor, sort_by in (("not-a-cursor", 'id'), (page.metadata.next_cursor, 'created_at')):
+            with pytest.raises(CustomException) as e:
+                cursor_paginate(User, session.query(User), CursorParams(cursor=cursor, sort_by=sort_by), SORTABLE)
+            assert e.value.http_code == 400
@@ -0,0 +1,142 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.helpers.queue import sweeper, task_state
+from app.helpers.queue.sweeper import TaskDeadlineSweeper
+from app.helpers.queue.task_state import TaskStateStore, AsyncTaskStateStore, DEADLINES_KEY, task_key
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    redis, redis_async = fakeredis.FakeRedis(server=server), fakeredis.FakeAsyncRedis(server=server)
+    monkeypatch.setattr(task_state, "redis", redis)
+    monkeypatch.setattr(task_state, "redis_async", redis_async)
+    monkeypatch.setattr(task_state, "_transition", redis.register_script(task_state.TRANSITION_SCRIPT))
+    monkeypatch.setattr(task_state, "_transition_async", redis_async.register_script(task_state.TRANSITION_SCRIPT))
+    monkeypatch.setattr(sweeper, "redis_async", redis_async)
+    return redis
+
+
+def create_task(task_id: str, start_generate: float) -> None:
+    TaskStateStore.create(task_id, {
+        "status": {"general_status": "PENDING", "task_status": None},
+        "time": {"start_generate": str(start_generate), "end_generate": None},
+    })
+
+
+def deadline(redis, task_id: str):
+    return redis.zscore(DEADLINES_KEY, task_id)
+
+
+class TestTransitionScript:
+    def test_guards(self, fake_redis):
+        """
+            Each transition only applies from the states it allows
+            Step by step:
+            - Create a PENDING task, start it twice, finish it, then kill it
+            - Expected:
+                . the second STARTED and the KILLED after SUCCESS are rejected, the state is unchanged
+                . a transition on a missing task is rejected
+        """
+        create_task("t1", 1000.0)
+        assert TaskStateStore.started("t1") is True
+        assert TaskStateStore.started("t1") is False
+        assert TaskStateStore.success("t1", {"data": 1}) is True
+        assert TaskStateStore.killed("t1") is False
+        assert TaskStateStore.failed("t1", {"code": "500"}) is False
+
+        message = TaskStateStore.get("t1")
+        assert message["status"] == {"general_status": "SUCCESS", "task_status": "SUCCESS"}
+        assert message["task_result"] == {"data": 1}
+        assert message["error"] is None
+        assert TaskStateStore.started("missing") is False
+
+    def test_killed_while_pending(self, fake_redis):
+        """
+            A killed PENDING task can't be started by a worker afterwards
+            Step by step:
+            - Create a PENDING task, kill it, then start it
+            - Expected:
+                . KILLED, no deadline left, STARTED rejected
+        """
+        create_task("t1", 1000.0)
+        assert TaskStateStore.killed("t1") is True
+        assert TaskStateStore.started("t1") is False
+        assert TaskStateStore.get("t1")["status"]["general_status"] == "KILLED"
+        assert deadline(fake_redis, "t1") is None
+
+    def test_deadlines(self, fake_redis):
+        """
+            Deadlines follow the state: PENDING from the enqueue time, STARTED from the start, none once finished
+            Step by step:
+            - Create a task enqueued at t=1000, start it, finish it
+            - Expected:
+                . PENDING: 1000 + QUEUE_TIMEOUT
+                . STARTED: started_at + QUEUE_TIME_LIMIT * 2, not based on the enqueue time
+                . SUCCESS: no deadline
+        """
+        create_task("t1", 1000.0)
+        assert deadline(fake_redis, "t1") == 1000.0 + float(settings.QUEUE_TIMEOUT)
+
+        TaskStateStore.started("t1")
+        started_at = float(fake_redis.hget(task_key("t1"), "started_at"))
+        assert started_at > 1000.0
+        assert deadline(fake_redis, "t1") == pytest.approx(started_at + float(settings.QUEUE_TIME_LIMIT) * 2)
+        assert "started_at" not in json.dumps(TaskStateStore.get("t1"))
+
+        TaskStateStore.success("t1", {})
+        assert deadline(fake_redis, "t1") is None
+
+    def test_publish(self, fake_redis):
+        """
+            Applied transitions are published on the task channel, rejected ones are not
+            Step by step:
+            - Subscribe to the task channel, start the task twice
+            - Expected:
+                . one message, with the STARTED state
+        """
+        create_task("t1", 1000.0)
+        pubsub = fake_redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(task_state.task_channel("t1"))
+        pubsub.get_message()
+
+        TaskStateStore.started("t1")
+        TaskStateStore.started("t1")
+        messages = []
+        while (message := pubsub.get_message()) is not None:
+            messages.append(task_state.to_message(json.loads(message["data"])))
+        assert [message["status"]["task_status"] for message in messages] == ["STARTED"]
+
+
+class TestDeadlineSweeper:
+    def test_sweep(self, fake_redis):
+        """
+            Overdue tasks are marked, others are left alone
+            Step by step:
+            - An overdue PENDING task, a running task whose deadline passed, a fresh PENDING task
+            - Expected:
+                . TIMEOUT, TIMELIMIT, still PENDING
+        """
+        create_task("pending", 1000.0)
+        create_task("started", 1000.0)
+        TaskStateStore.started("started")
+        fake_redis.zadd(DEADLINES_KEY, {"started": 1000.0})
+        create_task("fresh", task_state.datetime.utcnow().timestamp())
+
+        async def sweep():
+            return await TaskDeadlineSweeper.sweep(), await AsyncTaskStateStore.get_many(["pending", "started", "fresh"])
+
+        swept, messages = asyncio.run(sweep())
+        assert swept == 2
+        statuses = [message["status"] for message in messages]
+        assert [status["general_status"] for status in statuses] == ["TIMEOUT", "TIMELIMIT", "PENDING"]
+        assert deadline(fake_redis, "pending") is None
+        assert deadline(fake_redis, "started") is None
+        assert deadline(fake_redis, "fresh") is not None
@@ -0,0 +1,102 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.core.config import settings
+from app.helpers import web_scraper
+from app.helpers.web_scraper import WebScraper, extract_text
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def scraper(monkeypatch):
+    """WebScraper on fakeredis, its client replaced per test through `use_transport`."""
+    monkeypatch.setattr(web_scraper, "redis_async", fakeredis.FakeAsyncRedis())
+
+    def use_transport(handler):
+        monkeypatch.setattr(WebScraper, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    return use_transport
+
+
+class TestExtractText:
+    def test_drop_scripts(self):
+        """
+            Scripts and styles never reach the text, in the head or in the body
+            Step by step:
+            - Page with a script in <head>, a script and a style in <body>
+            - Expected:
+                . only the visible text
+        """
+        body = (b"<html><head><title>t</title><script>var head = 1;</script></head>"
+                b"<body>hello <script>var tracking = 1;</script><style>p {color: red}</style>world</body></html>")
+        assert extract_text(body, "text/html") == "hello world"
+
+    def test_plain_text(self):
+        """
+            Plain text pages are only whitespace collapsed
+            Step by step:
+            - text/plain body with newlines and tabs
+            - Expected:
+                . words joined by single spaces
+        """
+        assert extract_text(b"a\n\n b\tc ", "text/plain") == "a b c"
+
+
+class TestWebScraper:
+    def test_scrape(self, scraper):
+        """
+            Pages are returned in `urls` order, short and failed pages skipped
+            Step by step:
+            - One long page, one short page, one 500
+            - Expected:
+                . only the long page
+        """
+        long_text = " ".join(["word"] * 60)
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/long":
+                return httpx.Response(200, headers={"content-type": "text/plain"}, content=long_text.encode())
+            if request.url.path == "/short":
+                return httpx.Response(200, headers={"content-type": "text/plain"}, content=b"too short")
+            return httpx.Response(500)
+
+        scraper(handler)
+        urls = ["http://site/short", "http://site/long", "http://site/error"]
+        assert asyncio.run(WebScraper.scrape(urls)) == [long_text]
+
+    def test_slow_drip_timeout(self, scraper, monkeypatch):
+        """
+            A page that keeps sending bytes slowly is dropped after SCRAPE_TIMEOUT, not at the search deadline
+            Step by step:
+            - One page sending a chunk every 50 ms forever, one fast page, SCRAPE_TIMEOUT 0.3 s
+            - Expected:
+                . the fast page only, well before SCRAPE_DEADLINE
+        """
+        monkeypatch.setattr(settings, "SCRAPE_TIMEOUT", 0.3)
+        monkeypatch.setattr(settings, "SCRAPE_DEADLINE", 10)
+        fast_text = " ".join(["word"] * 60)
+
+        class SlowDrip(httpx.AsyncByteStream):
+            async def __aiter__(self):
+                while True:
+                    await asyncio.sleep(0.05)
+                    yield b"word "
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/slow":
+                return httpx.Response(200, headers={"content-type": "text/plain"}, stream=SlowDrip())
+            return httpx.Response(200, headers={"content-type": "text/plain"}, content=fast_text.encode())
+
+        scraper(handler)
+
+        async def scrape():
+            started = asyncio.get_running_loop().time()
+            texts = await WebScraper.scrape(["http://site/slow", "http://site/fast"])
+            return texts, asyncio.get_running_loop().time() - started
+
+        texts, elapsed = asyncio.run(scrape())
+        assert texts == [fast_text]
+        assert elapsed < 2
@@ -0,0 +1,150 @@
+import pytest
+
+pytest.importorskip("unstructured")
+pytest.importorskip("qdrant_client")
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from langchain_core.documents import Document  # noqa: E402
+from qdrant_client import QdrantClient  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from worker import dedup  # noqa: E402
+from worker.dedup import DocumentDedupCache, DIGEST_KEY_PREFIX, REFS_KEY_PREFIX  # noqa: E402
+from worker.tasks import embed_doc  # noqa: E402
+from worker.tasks.embed_doc import embed_data_for_chatrag  # noqa: E402
+from worker.vector_store import VectorStoreService, SOURCE_ID_KEY, point_id  # noqa: E402
+
+DATA_ID = "shared"
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = fakeredis.FakeRedis()
+    monkeypatch.setattr(dedup, "redis", redis)
+    monkeypatch.setattr(dedup, "_acquire", redis.register_script(dedup.ACQUIRE_SCRIPT))
+    monkeypatch.setattr(dedup, "_release", redis.register_script(dedup.RELEASE_SCRIPT))
+    monkeypatch.setattr(dedup, "_detach", redis.register_script(dedup.DETACH_SCRIPT))
+    return redis
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """In memory Qdrant, with a collection of two sources ('a', 'b') built for the digest 'digest'."""
+    store = VectorStoreService(client=QdrantClient(":memory:"))
+    monkeypatch.setattr(dedup, "VectorStoreService", lambda: store)
+    monkeypatch.setattr(embed_doc, "VectorStoreService", lambda: store)
+
+    store.create(DATA_ID, size=2)
+    documents = [Document(page_content=f"{source} chunk", metadata={SOURCE_ID_KEY: source}) for source in "ab"]
+    store.upsert(DATA_ID, documents, [[1.0, 0.0], [0.0, 1.0]],
+                 [point_id(document.metadata[SOURCE_ID_KEY], document.page_content) for document in documents])
+    return store
+
+
+def remove_request(source_id: str) -> dict:
+    return {'chat_type': "rag", 'files_path': [], 'web_urls': [], 'data_id': DATA_ID, 'remove_sources': [source_id]}
+
+
+def refs(redis, data_id: str):
+    value = redis.get(f"{REFS_KEY_PREFIX}{data_id}")
+    return int(value) if value is not None else None
+
+
+class TestDocumentDedupCache:
+    def test_digest(self, tmp_path, monkeypatch):
+        """
+            Identical files embedded the same way share a digest, another embedding model doesn't
+            Step by step:
+            - Digest of the same file for 'lc' and 'rag', then 'rag' with another EM_MODEL / EM_VECTOR_SIZE
+            - Expected:
+                . stable, and different for each chat type, model and vector size
+        """
+        file_path = tmp_path / "doc.txt"
+        file_path.write_bytes(b"content")
+        digest = DocumentDedupCache.digest("rag", [str(file_path)])
+        assert digest == DocumentDedupCache.digest("rag", [str(file_path)])
+        assert digest != DocumentDedupCache.digest("lc", [str(file_path)])
+
+        monkeypatch.setattr(settings, "EM_MODEL", "other-model")
+        other_model = DocumentDedupCache.digest("rag", [str(file_path)])
+        monkeypatch.setattr(settings, "EM_VECTOR_SIZE", settings.EM_VECTOR_SIZE * 2)
+        assert len({digest, other_model, DocumentDedupCache.digest("rag", [str(file_path)])}) == 3
+
+    def test_remove_from_shared_copies(self, fake_redis, store):
+        """
+            Removing sources from a data_id shared by identical uploads works on a copy
+            Step by step:
+            - 'shared' registered for a digest, then reused by an identical upload (2 references)
+            - First owner removes source 'a'
+            - Expected:
+                . a new data_id with only 'b', 'shared' still has 'a' and 'b' and is still reused for the digest
+                . 'shared' down to 1 reference
+        """
+        DocumentDedupCache.register("digest", DATA_ID)
+        assert DocumentDedupCache.acquire("rag", "digest") == DATA_ID
+        assert refs(fake_redis, DATA_ID) == 2
+
+        data_id, sources, _ = embed_data_for_chatrag(remove_request("a"), "task")
+
+        assert data_id != DATA_ID
+        assert sources == []
+        assert not store.has_source(data_id, "a") and store.has_source(data_id, "b")
+        assert store.has_source(DATA_ID, "a") and store.has_source(DATA_ID, "b")
+        assert refs(fake_redis, DATA_ID) == 1
+        assert DocumentDedupCache.acquire("rag", "digest") == DATA_ID
+
+    def test_remove_from_owned_in_place(self, fake_redis, store):
+        """
+            The only owner of a deduplicated data_id modifies it in place, and it stops being reused
+            Step by step:
+            - 'shared' registered for a digest (1 reference), owner removes source 'a'
+            - Expected:
+                . same data_id without 'a', digest and reference count dropped
+        """
+        DocumentDedupCache.register("digest", DATA_ID)
+
+        data_id, _, _ = embed_data_for_chatrag(remove_request("a"), "task")
+
+        assert data_id == DATA_ID
+        assert not store.has_source(DATA_ID, "a") and store.has_source(DATA_ID, "b")
+        assert fake_redis.get(f"{DIGEST_KEY_PREFIX}digest") is None
+        assert refs(fake_redis, DATA_ID) is None
+        assert DocumentDedupCache.acquire("rag", "digest") is None
+
+    def test_last_owner_after_copies(self, fake_redis, store):
+        """
+            Owners leaving a shared data_id one by one: the copy on write ones release it, the last one owns it
+            Step by step:
+            - 'shared' used by 3 identical uploads, two of them remove a source (copies), then the third one
+            - Expected:
+                . 2 copies, then the third one modifies 'shared' in place
+        """
+        DocumentDedupCache.register("digest", DATA_ID)
+        DocumentDedupCache.acquire("rag", "digest")
+        DocumentDedupCache.acquire("rag", "digest")
+
+        copies = {embed_data_for_chatrag(remove_request("a"), "task")[0] for _ in range(2)}
+        assert DATA_ID not in copies and len(copies) == 2
+        assert refs(fake_redis, DATA_ID) == 1
+
+        assert embed_data_for_chatrag(remove_request("a"), "task")[0] == DATA_ID
+        assert not store.has_source(DATA_ID, "a")
+        assert all(store.has_source(data_id, "b") for data_id in copies)
+
+    def test_release(self, fake_redis, store):
+        """
+            The last reference released deletes the artifact and its digest
+            Step by step:
+            - 'shared' with 2 references, released twice
+            - Expected:
+                . still there after the first release, deleted with the second
+        """
+        DocumentDedupCache.register("digest", DATA_ID)
+        DocumentDedupCache.acquire("rag", "digest")
+
+        assert DocumentDedupCache.release("rag", DATA_ID) == 1
+        assert store.exists(DATA_ID)
+        assert DocumentDedupCache.release("rag", DATA_ID) == 0
+        assert not store.exists(DATA_ID)
+        assert DocumentDedupCache.acquire("rag", "digest") is None
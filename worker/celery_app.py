@@ -13,7 +13,7 @@ app.config_from_object({
     'task_queues': [
         Queue(name=settings.WORKER_NAME),
     ],
-    'result_expires': 60 * 60 * 48,
+    'result_expires': settings.QUEUE_RESULT_EXPIRES,
     'task_always_eager': False,
 })
 
@@ -1,55 +1,48 @@
 import logging
 import mimetypes
+import multiprocessing
 import os
-import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from copy import deepcopy
 from datetime import datetime
-from typing import Union, List, Dict, Tuple, Iterator
+from typing import Union, List, Dict, Tuple, Iterator, Optional, Iterable
 
-from app.mq_main import redis
+from app.core.config import settings
+from app.helpers.queue.task_state import TaskStateStore
+from app.helpers.queue.cancellation import TaskCancellation
 
+from celery.signals import worker_process_shutdown, worker_shutdown
 from unstructured.documents.elements import Element, ElementType
 from langchain_core.documents import Document
 
+from worker.embedding_cache import EndpointEmbeddings
+
 
 class TaskStatusManager(object):
     __instance = None
 
     @staticmethod
-    def started(task_id: str, data: dict):
-        data['status']['general_status'] = "SUCCESS"
-        data['status']['task_status'] = "STARTED"
-        data_dump = json.dumps(data)
-        redis.set(task_id, data_dump)
+    def started(task_id: str):
+        if not TaskStateStore.started(task_id):
+            TaskCancellation.acknowledge(task_id)
+            raise ValueError("Task is no longer pending!")
 
     @staticmethod
-    def failed(task_id: str, data: dict, err: dict):
-        data['time']['end_generate'] = str(datetime.utcnow().timestamp())
-        data['status']['task_status'] = "FAILED"
-        data['error'] = err
-        data_dump = json.dumps(data)
-        redis.set(task_id, data_dump)
+    def failed(task_id: str, err: dict):
+        TaskStateStore.failed(task_id, err)
 
     @staticmethod
-    def success(task_id: str, data: dict, response: dict):
-        data['time']['end_generate'] = str(datetime.utcnow().timestamp())
-        data['status']['task_status'] = "SUCCESS"
-        data['task_result'] = response
-        data_dump = json.dumps(data)
-        redis.set(task_id, data_dump)
+    def success(task_id: str, response: dict):
+        TaskStateStore.success(task_id, response)
 
     @staticmethod
     def check_task_removed(task_id: str):
-        json_tasks_removed = redis.get("tasks_removed")
-        if not json_tasks_removed:
-            tasks_removed = []
-            redis.set("tasks_removed", json.dumps(tasks_removed))
-        else:
-            tasks_removed = json.loads(json_tasks_removed)
-
-        if task_id in tasks_removed:
-            tasks_removed.remove(task_id)
-            raise ValueError("Task killed!")
+        TaskCancellation.check(task_id)
 
 
 class WorkerCommonService(object):
@@ -72,6 +65,51 @@ class WorkerCommonService(object):
 
         return None
 
+    @staticmethod
+    def prefetch(iterable: Iterable, maxsize: int) -> Iterator:
+        """
+        Consume `iterable` in a background thread, at most `maxsize` items ahead of the caller.
+        Its errors are raised to the caller; stopping the caller early stops it too.
+        """
+        items = queue.Queue(maxsize=maxsize)
+        stop = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    items.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            iterator = iter(iterable)
+            try:
+                for item in iterator:
+                    if not put((item, None)):
+                        return
+                put((done, None))
+            except BaseException as e:
+                put((done, e))
+            finally:
+                if hasattr(iterator, "close"):
+                    iterator.close()
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item, error = items.get()
+                if error is not None:
+                    raise error
+                if item is done:
+                    return
+                yield item
+        finally:
+            stop.set()
+
     @staticmethod
     def upload_s3_file(file_path: str, content_type: str, folder_in_s3: str):
         from worker.upload_s3 import upload_file
@@ -103,9 +141,71 @@ class WorkerCommonService(object):
         return urls
 
 
+_loader_process_pool: Optional[ProcessPoolExecutor] = None
+_loader_thread_pool: Optional[ThreadPoolExecutor] = None
+_endpoint_embeddings: Optional[EndpointEmbeddings] = None
+
+
+def loader_process_pool() -> ProcessPoolExecutor:
+    global _loader_process_pool
+    if _loader_process_pool is None:
+        # 'spawn': children must not inherit the task process (eventlet hub, open connections)
+        _loader_process_pool = ProcessPoolExecutor(max_workers=settings.WORKER_LOADER_PROCESSES,
+                                                   mp_context=multiprocessing.get_context("spawn"))
+    return _loader_process_pool
+
+
+def reset_loader_process_pool() -> None:
+    global _loader_process_pool
+    if _loader_process_pool is not None:
+        _loader_process_pool.shutdown(wait=False, cancel_futures=True)
+        _loader_process_pool = None
+
+
+def loader_thread_pool() -> ThreadPoolExecutor:
+    global _loader_thread_pool
+    if _loader_thread_pool is None:
+        _loader_thread_pool = ThreadPoolExecutor(max_workers=settings.WORKER_LOADER_THREADS)
+    return _loader_thread_pool
+
+
+def endpoint_embeddings() -> EndpointEmbeddings:
+    """One embedding client (connection pool, adapted batch size) per worker process."""
+    global _endpoint_embeddings
+    if _endpoint_embeddings is None:
+        _endpoint_embeddings = EndpointEmbeddings()
+    return _endpoint_embeddings
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_endpoint_embeddings(**kwargs) -> None:
+    global _endpoint_embeddings
+    if _endpoint_embeddings is not None:
+        _endpoint_embeddings.close()
+        _endpoint_embeddings = None
+
+
+def timed_load(file_path: str = None, web_url: str = None) -> Tuple[list[Element], float]:
+    start = time.perf_counter()
+    elements = DocumentLoaderService.loader(file_path=file_path, web_url=web_url)
+    return elements, time.perf_counter() - start
+
+
 class DocumentLoaderService(object):
     __instance = None
 
+    # `chunk_by_title` params, also part of the ingestion dedup key
+    CHUNKING_PARAMS = {
+        "max_characters": 200*4, # Giới hạn cứng: mỗi khối không vượt quá n ký tự
+        "combine_text_under_n_chars": 20*4, # Kết hợp các phần tử nhỏ hơn n ký tự
+        "new_after_n_chars": 100*4, # Giới hạn mềm: dừng mở rộng khi đạt n ký tự
+        "include_orig_elements": True,
+        "multipage_sections": True,
+        "overlap": 50, # Ký tự cuối được chèn vào đầu khối tiếp theo nếu khối bị chia nhỏ
+        "overlap_all": False, # Chồng chéo chỉ áp dụng với các khối bị chia nhỏ
+    }
+
     @staticmethod
     def loader(file_path = None, web_url = None) -> list[Element]:
         """
@@ -171,14 +271,56 @@ class DocumentLoaderService(object):
 
     @staticmethod
     def loaders(files_path: list, web_urls: list) -> list[list[Element]]:
-        docs = []
-        for web_url in web_urls:
-            docs.append(DocumentLoaderService().loader(web_url=web_url))
-        for file_path in files_path:
-            docs.append(DocumentLoaderService().loader(file_path=file_path))
-
+        docs, _ = DocumentLoaderService().timed_loaders(files_path, web_urls)
         return docs
 
+    @staticmethod
+    def timed_loaders(files_path: list, web_urls: list) -> Tuple[list[list[Element]], list[dict]]:
+        """Load urls then files, in order, with [{'source', 'seconds'}] of each one."""
+        timings = []
+        docs = list(DocumentLoaderService().iter_loaders(files_path, web_urls, timings))
+        return docs, timings
+
+    @staticmethod
+    def iter_loaders(files_path: list, web_urls: list, timings: list = None) -> Iterator[list[Element]]:
+        """
+        Yield elements of urls then files, in order; append {'source', 'seconds'} of each one to `timings`.
+
+        Files are partitioned in a process pool (CPU bound: pdf, image, ...) and urls fetched in a thread
+        pool, so the whole upload takes about as long as its slowest file. At most WORKER_LOADER_PROCESSES
+        sources are loaded ahead of the consumer.
+        Set WORKER_LOADER_PROCESSES=0 to load sequentially in the task process.
+        """
+        sources = [(None, web_url) for web_url in web_urls] + [(file_path, None) for file_path in files_path]
+        window = settings.WORKER_LOADER_PROCESSES
+
+        def submit(file_path, web_url):
+            if web_url:
+                return loader_thread_pool().submit(timed_load, None, web_url)
+            return loader_process_pool().submit(timed_load, file_path, None)
+
+        pending = deque()
+        try:
+            for i, (file_path, web_url) in enumerate(sources):
+                if window <= 0 or len(sources) <= 1:
+                    elements, seconds = timed_load(file_path, web_url)
+                else:
+                    while len(pending) < window and i + len(pending) < len(sources):
+                        pending.append(submit(*sources[i + len(pending)]))
+                    elements, seconds = pending.popleft().result()
+
+                if timings is not None:
+                    timings.append({"source": web_url or os.path.basename(file_path), "seconds": round(seconds, 3)})
+                logging.getLogger('celery').info(f"Loaded '{web_url or file_path}' in {seconds:.3f}s")
+                yield elements
+        except BrokenProcessPool:
+            # A child died (OOM, segfault): start a new pool for the next task
+            reset_loader_process_pool()
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
     @staticmethod
     def cleaner(elements: list[Element]) -> list[Element]:
         """
@@ -285,17 +427,32 @@ class DocumentLoaderService(object):
 
         chunks = chunk_by_title(
             elements=list_element,
-            max_characters=200*4, # Giới hạn cứng: mỗi khối không vượt quá n ký tự
-            combine_text_under_n_chars=20*4, # Kết hợp các phần tử nhỏ hơn n ký tự
-            new_after_n_chars=100*4, # Giới hạn mềm: dừng mở rộng khi đạt n ký tự
-            include_orig_elements=True,
-            multipage_sections=True,
-            overlap=50, # Ký tự cuối được chèn vào đầu khối tiếp theo nếu khối bị chia nhỏ
-            overlap_all=False, # Chồng chéo chỉ áp dụng với các khối bị chia nhỏ
+            **DocumentLoaderService.CHUNKING_PARAMS,
         )
 
         return chunks
 
+    @staticmethod
+    def iter_document_batches(docs: Iterable[list[Element]], batch_size: int,
+                              metadatas: Iterable[dict] = None) -> Iterator[List[Document]]:
+        """
+        Chunk each document as it comes and yield its LangChain documents by `batch_size`.
+        `metadatas`: extra metadata of each document's chunks, in order.
+        """
+        batch = []
+        metadatas = iter(metadatas) if metadatas is not None else None
+        for elements in docs:
+            chunks = DocumentLoaderService().chunker([elements])
+            extra = next(metadatas) if metadatas is not None else {}
+            for document in DocumentLoaderService().elements_to_documents(chunks):
+                document.metadata.update(extra)
+                batch.append(document)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
     # Element (Unstructured) -> Documents(Langchain)
     @staticmethod
     def elements_to_documents(elements: List[Element]) -> List[Document]:
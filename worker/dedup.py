@@ -0,0 +1,162 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Optional, List
+
+from app.core.config import settings
+from app.helpers.llm.lc_store import LCDocumentStore, lc_file_path
+from app.mq_main import redis
+
+from worker.common import DocumentLoaderService
+from worker.vector_store import VectorStoreService, file_source_id
+
+DIGEST_KEY_PREFIX = "embed_doc:digest:"  # digest -> data_id
+REFS_KEY_PREFIX = "embed_doc:refs:"  # data_id -> number of uploads sharing it
+SOURCE_KEY_PREFIX = "embed_doc:source:"  # data_id -> digest
+
+# Take a reference on the data_id of a digest.
+# KEYS[1]: digest key
+# ARGV[1]: refs key prefix
+ACQUIRE_SCRIPT = """
+local data_id = redis.call('GET', KEYS[1])
+if not data_id then
+    return false
+end
+local refs_key = ARGV[1] .. data_id
+if redis.call('EXISTS', refs_key) == 0 then
+    return false
+end
+redis.call('INCR', refs_key)
+return data_id
+"""
+
+# Drop a reference; the last one unlinks the digest so nobody can acquire it anymore.
+# KEYS[1]: refs key, KEYS[2]: source key
+# ARGV[1]: digest key prefix, ARGV[2]: data_id
+# Return refs left (0: the artifact can be deleted)
+RELEASE_SCRIPT = """
+local refs = redis.call('DECR', KEYS[1])
+if refs > 0 then
+    return refs
+end
+local digest = redis.call('GET', KEYS[2])
+if digest and redis.call('GET', ARGV[1] .. digest) == ARGV[2] then
+    redis.call('DEL', ARGV[1] .. digest)
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return 0
+"""
+
+# About to modify data_id in place: unlink it from its digest, unless other uploads share it.
+# KEYS[1]: refs key, KEYS[2]: source key
+# ARGV[1]: digest key prefix, ARGV[2]: data_id
+# Return refs (> 1: shared, the caller must work on a copy and `release` this one)
+DETACH_SCRIPT = """
+local refs = tonumber(redis.call('GET', KEYS[1]) or '0')
+if refs > 1 then
+    return refs
+end
+local digest = redis.call('GET', KEYS[2])
+if digest and redis.call('GET', ARGV[1] .. digest) == ARGV[2] then
+    redis.call('DEL', ARGV[1] .. digest)
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return refs
+"""
+
+_acquire = redis.register_script(ACQUIRE_SCRIPT)
+_release = redis.register_script(RELEASE_SCRIPT)
+_detach = redis.register_script(DETACH_SCRIPT)
+
+
+class DocumentDedupCache(object):
+    """
+    Content-addressed cache of `embed_doc` artifacts (`.md` file for 'lc', Qdrant collection for 'rag').
+
+    SHA-256(chat_type, chunking and embedding params, file bytes) -> data_id, with a reference count per data_id:
+    the same upload reuses the existing data_id. Modifying a shared data_id (append/remove sources) is copy on
+    write: the caller moves to a private copy and `release`s the shared one, the last `release` deletes it.
+    Web pages may change between requests, so requests with `web_urls` are never deduplicated.
+    """
+    __instance = None
+
+    @staticmethod
+    def digest(chat_type: str, files_path: List[str]) -> str:
+        sha = hashlib.sha256()
+        sha.update(chat_type.encode())
+        if chat_type == "rag":
+            # Same files chunked or embedded differently are different collections
+            sha.update(json.dumps(DocumentLoaderService.CHUNKING_PARAMS, sort_keys=True).encode())
+            sha.update(json.dumps([settings.EM_MODEL, settings.EM_VECTOR_SIZE]).encode())
+        for file_path in files_path:
+            sha.update(bytes.fromhex(file_source_id(file_path)))
+        return sha.hexdigest()
+
+    @staticmethod
+    def is_cacheable(request: dict) -> bool:
+        # Appending to / removing from an existing data_id is never shared
+        return (bool(request['files_path']) and not request['web_urls']
+                and not request.get('data_id') and not request.get('remove_sources'))
+
+    @staticmethod
+    def artifact_exists(chat_type: str, data_id: str) -> bool:
+        if chat_type == "lc":
+            return os.path.exists(lc_file_path(data_id))
+        elif chat_type == "rag":
+            return VectorStoreService().exists(data_id)
+        return False
+
+    @staticmethod
+    def delete_artifact(chat_type: str, data_id: str) -> None:
+        if chat_type == "lc":
+            LCDocumentStore.delete(data_id)
+        elif chat_type == "rag":
+            VectorStoreService().delete(data_id)
+
+    @staticmethod
+    def acquire(chat_type: str, digest: str) -> Optional[str]:
+        """Return the data_id already built for `digest` (taking a reference on it), None on miss."""
+        data_id = _acquire(keys=[f"{DIGEST_KEY_PREFIX}{digest}"], args=[REFS_KEY_PREFIX])
+        if not data_id:
+            return None
+        data_id = data_id.decode() if isinstance(data_id, bytes) else data_id
+
+        # Artifact removed out of band (volume wiped, collection dropped, ...): forget it
+        if not DocumentDedupCache.artifact_exists(chat_type, data_id):
+            logging.getLogger('celery').warning(f"Dedup artifact '{data_id}' is missing, rebuild it.")
+            redis.delete(f"{DIGEST_KEY_PREFIX}{digest}", f"{REFS_KEY_PREFIX}{data_id}", f"{SOURCE_KEY_PREFIX}{data_id}")
+            return None
+        return data_id
+
+    @staticmethod
+    def register(digest: str, data_id: str) -> None:
+        """Own the first reference on a freshly built data_id and publish it for `digest`."""
+        pipe = redis.pipeline(transaction=True)
+        pipe.set(f"{REFS_KEY_PREFIX}{data_id}", 1)
+        pipe.set(f"{DIGEST_KEY_PREFIX}{digest}", data_id, nx=True)
+        pipe.set(f"{SOURCE_KEY_PREFIX}{data_id}", digest)
+        _, published, _ = pipe.execute()
+        if not published:
+            # Same content built concurrently by another task: keep ours private
+            redis.delete(f"{SOURCE_KEY_PREFIX}{data_id}")
+
+    @staticmethod
+    def detach(data_id: str) -> bool:
+        """
+        `data_id` is about to change: identical uploads must not reuse it anymore.
+        Return True when other uploads share it, it must then be copied (and released) rather than modified.
+        """
+        refs = _detach(keys=[f"{REFS_KEY_PREFIX}{data_id}", f"{SOURCE_KEY_PREFIX}{data_id}"],
+                       args=[DIGEST_KEY_PREFIX, data_id])
+        return refs > 1
+
+    @staticmethod
+    def release(chat_type: str, data_id: str) -> int:
+        """Drop one reference on `data_id`, delete its artifact with the last one. Return refs left."""
+        refs = _release(keys=[f"{REFS_KEY_PREFIX}{data_id}", f"{SOURCE_KEY_PREFIX}{data_id}"],
+                        args=[DIGEST_KEY_PREFIX, data_id])
+        if refs <= 0:
+            DocumentDedupCache.delete_artifact(chat_type, data_id)
+            return 0
+        return refs
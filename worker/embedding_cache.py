@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import re
+import threading
+from array import array
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import settings
+from app.helpers.llm.embedding_client import EmbeddingClient
+from app.mq_main import redis
+
+EMBEDDING_KEY_PREFIX = "embedding:"
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def embedding_key(text: str, model: str = None) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{EMBEDDING_KEY_PREFIX}{model or settings.EM_MODEL}:{digest}"
+
+
+def pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def unpack(data: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(data)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an `Embeddings` with a redis cache keyed by (model, SHA-256 of whitespace normalized text),
+    vectors stored as float32 bytes. Only misses (deduplicated) are sent to the underlying model.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str = None, ttl: int = None):
+        self.embeddings = embeddings
+        self.model = model or settings.EM_MODEL
+        self.ttl = ttl or settings.EM_CACHE_TTL
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        keys = [embedding_key(text, self.model) for text in texts]
+        vectors: List[Optional[List[float]]] = [None if data is None else unpack(data) for data in redis.mget(keys)]
+
+        # Identical chunks in one batch are embedded once
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], []).append(i)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            embedded = self.embeddings.embed_documents([texts[indexes[0]] for indexes in missing.values()])
+            pipe = redis.pipeline(transaction=False)
+            for (key, indexes), vector in zip(missing.items(), embedded):
+                pipe.set(key, pack(vector), ex=self.ttl)
+                for i in indexes:
+                    vectors[i] = vector
+            pipe.execute()
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class EndpointEmbeddings(Embeddings):
+    """
+    `Embeddings` on top of `EmbeddingClient`.
+
+    Sync calls (celery tasks) run on one event loop in a background thread, so the connection pool is reused
+    across calls. Meant to live as long as its process, `close` stops the loop.
+    """
+
+    def __init__(self, client: EmbeddingClient = None):
+        self.client = client or EmbeddingClient()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+
+    def _run(self, coroutine):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._thread.start()
+            loop = self._loop
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._run(self.client.embed(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.client.embed(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.client.embed([text]))[0]
+
+    def close(self) -> None:
+        with self._loop_lock:
+            loop, thread, self._loop, self._thread = self._loop, self._thread, None, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self.client.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
@@ -3,12 +3,18 @@ import logging
 import json
 import os
 import uuid
+from collections import Counter, defaultdict
+from typing import Tuple, Iterable
 
 from app.core.config import settings
+from app.helpers.llm.lc_store import LCDocumentStore
 
 from worker.tasks import BaseTask
 from worker.celery_app import app
-from worker.common import TaskStatusManager, DocumentLoaderService, WorkerCommonService
+from worker.common import TaskStatusManager, DocumentLoaderService, WorkerCommonService, endpoint_embeddings
+from worker.dedup import DocumentDedupCache
+from worker.embedding_cache import CachedEmbeddings
+from worker.vector_store import VectorStoreService, SOURCE_ID_KEY, file_source_id, point_id
 from celery.exceptions import SoftTimeLimitExceeded
 from amqp.exceptions import PreconditionFailed
 
@@ -33,6 +39,8 @@ def embed_doc_task(self, task_id: str, data: bytes, request: bytes):
                 'chat_type': ['lc', 'rag'],
                 'files_path': [],
                 'web_urls': [],
+                'data_id': None,  # 'rag': append to this collection
+                'remove_sources': [],  # 'rag': source ids to remove from data_id
             }
     """
     print(f"============= [{task_id}][{inspect.currentframe().f_code.co_name}]: Started ===================")
@@ -40,89 +48,199 @@ def embed_doc_task(self, task_id: str, data: bytes, request: bytes):
         # Load data
         data = json.loads(data)
         request = json.loads(request)
-        TaskStatusManager.started(task_id, data)
+        TaskStatusManager.started(task_id)
 
         # Check task removed
         TaskStatusManager.check_task_removed(task_id)
 
-        # Load file/url
-        print("Document Loader: ...")
-        docs = DocumentLoaderService().loaders(request['files_path'], request['web_urls'])
-        # docs = DocumentLoaderService().cleaners(docs)
-
-        # Save/Embed follow chat type
-        if request['chat_type'] == "lc":
-            print("Save data with [chat_type] 'Long Context'")
-            data_id = save_file_for_chatlc(docs)
-        elif request['chat_type'] == "rag":
-            print("Save data with [chat_type] 'RAG'")
-            data_id = embed_data_for_chatrag(docs)
-        else:
+        if request['chat_type'] not in ("lc", "rag"):
             raise ValueError(f"Don't support [chat_type] '{request['chat_type']}'")
-        print("Document Loader: Done")
+
+        # Same files already ingested
+        digest, data_id, sources, embedding_stats, loader_timings = None, None, None, None, []
+        if DocumentDedupCache.is_cacheable(request):
+            digest = DocumentDedupCache.digest(request['chat_type'], request['files_path'])
+            data_id = DocumentDedupCache.acquire(request['chat_type'], digest)
+
+        if data_id:
+            print(f"Document Loader: Reuse '{data_id}'")
+        else:
+            # Load file/url (streamed: each document is saved/embedded as soon as it is loaded)
+            # Save/Embed follow chat type
+            print("Document Loader: ...")
+            if request['chat_type'] == "lc":
+                print("Save data with [chat_type] 'Long Context'")
+                docs = DocumentLoaderService().iter_loaders(request['files_path'], request['web_urls'], loader_timings)
+                # docs = map(DocumentLoaderService().cleaner, docs)
+                data_id = save_file_for_chatlc(docs, task_id)
+            else:
+                print("Save data with [chat_type] 'RAG'")
+                data_id, sources, embedding_stats = embed_data_for_chatrag(request, task_id, loader_timings)
+            if digest:
+                DocumentDedupCache.register(digest, data_id)
+            print("Document Loader: Done")
 
         response = {"data_id": data_id}
+        if sources is not None:
+            response["sources"] = sources
 
         # Successful
         metadata = {
             "task": inspect.currentframe().f_code.co_name.replace("_task", ""),
             "request": request
         }
+        if loader_timings:
+            metadata["loader_timings"] = loader_timings
+        if embedding_stats:
+            metadata["embedding"] = embedding_stats
         response = {"data": response, "metadata": metadata}
-        TaskStatusManager.success(task_id, data, response)
+        TaskStatusManager.success(task_id, response)
         return
 
     except ValueError as e:
         logging.getLogger('celery').error(str(e), exc_info=True)
         err = {'code': "400", 'message': str(e)}
-        TaskStatusManager.failed(task_id, data, err)
+        TaskStatusManager.failed(task_id, err)
         return
     except SoftTimeLimitExceeded as e:
         logging.getLogger('celery').error("SoftTimeLimitExceeded: " + str(e), exc_info=True)
         error = "Task was terminated after exceeding the time limit."
         err = {'code': "500", 'message': error}
-        TaskStatusManager.failed(task_id, data, err)
+        TaskStatusManager.failed(task_id, err)
         return
     except PreconditionFailed:
         e = "Time out to connect into broker."
         logging.getLogger('celery').error(str(e), exc_info=True)
         err = {'code': "500", 'message': "Internal Server Error"}
-        TaskStatusManager.failed(task_id, data, err)
+        TaskStatusManager.failed(task_id, err)
         return
     except Exception as e:
         logging.getLogger('celery').error(str(e), exc_info=True)
         err = {'code': "500", 'message': "Internal Server Error"}
-        TaskStatusManager.failed(task_id, data, err)
+        TaskStatusManager.failed(task_id, err)
         return
 
 
-def save_file_for_chatlc(elements: list[list[Element]]) -> str:
-    # Convert to .md
-    mds = DocumentLoaderService.docs_to_markdowns(elements)
-    md_content = '\n\n'.join(mds)
+def save_file_for_chatlc(elements: Iterable[list[Element]], task_id: str) -> str:
+    def markdowns():
+        for ele in elements:
+            TaskStatusManager.check_task_removed(task_id)
+            yield DocumentLoaderService.docs_to_markdowns([ele])[0]
 
-    # Save to .md
+    # Convert to .md, saved document by document with its token index
     data_id = str(uuid.uuid4())
-
-    file_name = os.path.join(settings.WORKER_DIRECTORY, "chatdoc/lc", f"{data_id}.md")
-    WorkerCommonService().save_file(file_name, md_content)
+    try:
+        LCDocumentStore.save(data_id, markdowns(), separator='\n\n')
+    except BaseException:
+        LCDocumentStore.delete(data_id)
+        raise
 
     return data_id
 
-def embed_data_for_chatrag(elements: list[list[Element]]) -> str:
-    from langchain_huggingface.embeddings import HuggingFaceEndpointEmbeddings
-    from langchain_qdrant import QdrantVectorStore
 
-    data_id = str(uuid.uuid4())
-    chunks = DocumentLoaderService().chunker(elements)
-
-    documents = DocumentLoaderService().elements_to_documents(chunks)
-    embeddings = HuggingFaceEndpointEmbeddings(model=settings.EM_URL)
-    QdrantVectorStore.from_documents(
-        documents,
-        embeddings,
-        url=settings.VDB_URL,
-        prefer_grpc=True,
-        collection_name=data_id,
-    )
-    return data_id
+def embed_data_for_chatrag(request: dict, task_id: str, loader_timings: list = None) -> Tuple[str, list, dict]:
+    """
+    Embed into a new collection, or append to `request['data_id']`.
+
+    Points are keyed by (source, chunk text) and tagged with their source id (sha256 of the file, or the web url):
+        - a file already in the collection is skipped (no load, no embed)
+        - a web page is re-upserted, then its chunks that disappeared are removed
+        - `request['remove_sources']` (source ids) removes only those sources' points
+    A data_id shared by identical uploads (dedup) is never modified: the changes go to a copy under a new data_id.
+
+    Streaming ingestion, stages linked by bounded queues so memory stays flat with the upload size:
+        load (per document) -> chunk -> batches of EM_MAX_BATCH_SIZE * EM_CONCURRENCY -> embed -> upsert into Qdrant
+    Return (data_id, [{'source_id', 'source', 'status'}], embedding stats).
+    """
+    store = VectorStoreService()
+    data_id = request.get('data_id') or str(uuid.uuid4())
+    ready = bool(request.get('data_id'))  # Collection exists
+    owned = not ready  # Collection created by this task, dropped on failure
+    shared_id = None
+    if ready:
+        if not store.exists(data_id):
+            raise ValueError(f"[data_id] '{data_id}' does not exist. Must 'embed before'")
+        if DocumentDedupCache.detach(data_id):
+            # Copy on write, the shared collection is released once the copy is complete
+            shared_id, data_id, owned = data_id, str(uuid.uuid4()), True
+            try:
+                store.copy(shared_id, data_id)
+                store.delete_sources(data_id, request.get('remove_sources') or [])
+            except BaseException:
+                if store.exists(data_id):
+                    store.delete(data_id)
+                raise
+        else:
+            store.delete_sources(data_id, request.get('remove_sources') or [])
+
+    # Sources to (re)load
+    sources, files_path, web_urls = [], [], []
+    for web_url in request['web_urls']:
+        sources.append({"source_id": web_url, "source": web_url, "status": "added"})
+        web_urls.append(web_url)
+    for file_path in request['files_path']:
+        source_id = file_source_id(file_path)
+        source = {"source_id": source_id, "source": os.path.basename(file_path).split("_", 1)[-1]}
+        if source_id in (s["source_id"] for s in sources) or (ready and store.has_source(data_id, source_id)):
+            sources.append(dict(source, status="unchanged"))
+        else:
+            sources.append(dict(source, status="added"))
+            files_path.append(file_path)
+    loaded = [source for source in sources if source["status"] == "added"]
+    if not loaded:
+        if shared_id:
+            DocumentDedupCache.release(request['chat_type'], shared_id)
+        return data_id, sources, {}
+
+    endpoint = endpoint_embeddings()
+    client_stats = endpoint.client.stats()
+    embeddings = CachedEmbeddings(endpoint)
+    queue_size = settings.WORKER_PIPELINE_QUEUE_SIZE
+    # Loaded in order: urls then files
+    docs = DocumentLoaderService().iter_loaders(files_path, web_urls, loader_timings)
+    # docs = map(DocumentLoaderService().cleaner, docs)
+
+    # Enough texts per `embed` call for EM_CONCURRENCY requests in flight, even at the largest batch size
+    batch_size = settings.EM_MAX_BATCH_SIZE * settings.EM_CONCURRENCY
+
+    def embedded_batches():
+        batches = WorkerCommonService.prefetch(
+            DocumentLoaderService().iter_document_batches(
+                docs, batch_size, [{SOURCE_ID_KEY: source["source_id"]} for source in loaded]),
+            queue_size)
+        for documents in batches:
+            TaskStatusManager.check_task_removed(task_id)
+            yield documents, embeddings.embed_documents([document.page_content for document in documents])
+
+    occurrences, url_point_ids = Counter(), defaultdict(list)
+    try:
+        for documents, vectors in WorkerCommonService.prefetch(embedded_batches(), queue_size):
+            if not ready:
+                if len(vectors[0]) != settings.EM_VECTOR_SIZE:
+                    logging.getLogger('celery').warning(
+                        f"EM_VECTOR_SIZE is {settings.EM_VECTOR_SIZE}, '{settings.EM_MODEL}' returns {len(vectors[0])}")
+                store.create(data_id, size=len(vectors[0]))
+                ready = True
+
+            ids = []
+            for document in documents:
+                key = (document.metadata[SOURCE_ID_KEY], document.page_content)
+                ids.append(point_id(*key, occurrences[key]))
+                occurrences[key] += 1
+                if key[0] in web_urls:
+                    url_point_ids[key[0]].append(ids[-1])
+            store.upsert(data_id, documents, vectors, ids)
+
+        # Web pages may have changed: drop chunks no longer there
+        for web_url in web_urls:
+            store.delete_sources(data_id, [web_url], keep_ids=url_point_ids[web_url])
+    except BaseException:
+        if ready and owned:
+            store.delete(data_id)
+        raise
+
+    if not ready:
+        raise ValueError("No content to embed!")
+    if shared_id:
+        DocumentDedupCache.release(request['chat_type'], shared_id)
+    return data_id, sources, {"cache": embeddings.stats(), "client": endpoint.client.stats(since=client_stats)}
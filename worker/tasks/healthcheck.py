@@ -30,7 +30,7 @@ def healthcheck_task(self, task_id: str, data: bytes):
     try:
         # Load data
         data = json.loads(data)
-        TaskStatusManager.started(task_id, data)
+        TaskStatusManager.started(task_id)
 
         # Check task removed
         TaskStatusManager.check_task_removed(task_id)
@@ -49,30 +49,30 @@ def healthcheck_task(self, task_id: str, data: bytes):
             "task": inspect.currentframe().f_code.co_name.replace("_task", ""),
         }
         response = {"data": data_response, "metadata": metadata}
-        TaskStatusManager.success(task_id, data, response)
+        TaskStatusManager.success(task_id, response)
         return
 
     except ValueError as e:
         logging.getLogger('celery').error(str(e), exc_info=True)
         err = {'code': "400", 'message': str(e)}
-        TaskStatusManager.failed(task_id, data, err)
+        TaskStatusManager.failed(task_id, err)
         return
     except SoftTimeLimitExceeded as e:
         logging.getLogger('celery').error("SoftTimeLimitExceeded: " + str(e), exc_info=True)
         error = "Task was terminated after exceeding the time limit."
         err = {'code': "500", 'message': error}
-        TaskStatusManager.failed(task_id, data, err)
+        TaskStatusManager.failed(task_id, err)
         return
     except PreconditionFailed:
         e = "Time out to connect into broker."
         logging.getLogger('celery').error(str(e), exc_info=True)
         err = {'code': "500", 'message': "Internal Server Error"}
-        TaskStatusManager.failed(task_id, data, err)
+        TaskStatusManager.failed(task_id, err)
         return
     except Exception as e:
         logging.getLogger('celery').error(str(e), exc_info=True)
         err = {'code': "500", 'message': "Internal Server Error"}
-        TaskStatusManager.failed(task_id, data, err)
+        TaskStatusManager.failed(task_id, err)
         return
 
 
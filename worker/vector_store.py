@@ -0,0 +1,157 @@
+import hashlib
+import uuid
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+from app.core.config import settings
+from app.helpers.llm.retrieval import SparseEncoder
+
+SOURCE_ID_KEY = "source_id"  # In document metadata: sha256 of the file bytes, or the web url
+
+
+def file_source_id(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def point_id(source_id: str, text: str, occurrence: int = 0) -> str:
+    """Stable id of a chunk: same source and same text -> same point (upsert is a no-op)."""
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source_id}:{digest}:{occurrence}"))
+
+
+class VectorStoreService(object):
+    """
+    Qdrant collections of 'rag' data, laid out like `QdrantVectorStore` (unnamed dense vector, BM25 sparse
+    vector, `page_content`/`metadata` payload) so LangChain can read them back.
+    """
+
+    def __init__(self, client=None):
+        from qdrant_client import QdrantClient
+
+        self.client = client or QdrantClient(url=settings.VDB_URL, prefer_grpc=True)
+        self._sparse = {}
+
+    @staticmethod
+    def source_filter(source_ids: List[str], exclude_ids: Optional[List[str]] = None):
+        from qdrant_client import models
+
+        return models.Filter(
+            must=[models.FieldCondition(key=f"metadata.{SOURCE_ID_KEY}", match=models.MatchAny(any=source_ids))],
+            must_not=[models.HasIdCondition(has_id=exclude_ids)] if exclude_ids else None,
+        )
+
+    def exists(self, collection_name: str) -> bool:
+        return self.client.collection_exists(collection_name)
+
+    def create(self, collection_name: str, size: int) -> None:
+        from langchain_qdrant import QdrantVectorStore
+        from qdrant_client import models
+
+        self.client.create_collection(
+            collection_name=collection_name,
+            vectors_config={
+                QdrantVectorStore.VECTOR_NAME: models.VectorParams(size=size, distance=models.Distance.COSINE)
+            },
+            # BM25 (hybrid retrieval): term weights per point, IDF applied by Qdrant
+            sparse_vectors_config={
+                QdrantVectorStore.SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)
+            },
+        )
+        self._sparse[collection_name] = True
+        self._index_sources(collection_name)
+
+    def _index_sources(self, collection_name: str) -> None:
+        from qdrant_client import models
+
+        self.client.create_payload_index(
+            collection_name=collection_name,
+            field_name=f"metadata.{SOURCE_ID_KEY}",
+            field_schema=models.PayloadSchemaType.KEYWORD,
+        )
+
+    def copy(self, collection_name: str, new_collection_name: str, batch_size: int = 256) -> None:
+        """New collection with the same config and points (vectors and payload) as `collection_name`."""
+        from qdrant_client import models
+
+        params = self.client.get_collection(collection_name).config.params
+        self.client.create_collection(
+            collection_name=new_collection_name,
+            vectors_config=params.vectors,
+            sparse_vectors_config=params.sparse_vectors,
+        )
+        self._index_sources(new_collection_name)
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name, limit=batch_size, offset=offset, with_payload=True, with_vectors=True
+            )
+            if points:
+                self.client.upsert(
+                    collection_name=new_collection_name,
+                    points=[models.PointStruct(id=point.id, vector=point.vector, payload=point.payload)
+                            for point in points],
+                )
+            if offset is None:
+                break
+
+    def has_sparse(self, collection_name: str) -> bool:
+        """Collections created before hybrid retrieval only have the dense vector."""
+        from langchain_qdrant import QdrantVectorStore
+
+        if collection_name not in self._sparse:
+            params = self.client.get_collection(collection_name).config.params
+            self._sparse[collection_name] = QdrantVectorStore.SPARSE_VECTOR_NAME in (params.sparse_vectors or {})
+        return self._sparse[collection_name]
+
+    def delete(self, collection_name: str) -> None:
+        self.client.delete_collection(collection_name)
+
+    def has_source(self, collection_name: str, source_id: str) -> bool:
+        return self.client.count(
+            collection_name=collection_name, count_filter=self.source_filter([source_id]), exact=True
+        ).count > 0
+
+    def delete_sources(self, collection_name: str, source_ids: List[str], keep_ids: List[str] = None) -> None:
+        """Remove points of `source_ids`, except `keep_ids`."""
+        from qdrant_client import models
+
+        if not source_ids:
+            return
+        self.client.delete(
+            collection_name=collection_name,
+            points_selector=models.FilterSelector(filter=self.source_filter(source_ids, keep_ids)),
+        )
+
+    def upsert(self, collection_name: str, documents: List[Document], vectors: List[List[float]],
+               ids: List[str]) -> None:
+        from langchain_qdrant import QdrantVectorStore
+        from qdrant_client import models
+
+        sparse = self.has_sparse(collection_name)
+
+        def point_vectors(document: Document, vector: List[float]) -> dict:
+            vectors = {QdrantVectorStore.VECTOR_NAME: vector}
+            indices, values = SparseEncoder.encode_document(document.page_content) if sparse else ([], [])
+            if indices:
+                vectors[QdrantVectorStore.SPARSE_VECTOR_NAME] = models.SparseVector(indices=indices, values=values)
+            return vectors
+
+        self.client.upsert(
+            collection_name=collection_name,
+            points=[
+                models.PointStruct(
+                    id=id,
+                    vector=point_vectors(document, vector),
+                    payload={
+                        QdrantVectorStore.CONTENT_KEY: document.page_content,
+                        QdrantVectorStore.METADATA_KEY: document.metadata,
+                    },
+                )
+                for id, document, vector in zip(ids, documents, vectors)
+            ],
+        )